@@ -21,7 +21,7 @@ import plotly.graph_objs as go
 import datetime
 import monthdelta
 
-from assets.content.history import *
+from ContentBundle import read_markdown, get_history
 
 def month_difference(first, second):
     '''
@@ -49,6 +49,9 @@ def draw_history_figure():
         figure: The plotly figure, ready to use
     '''
 
+    # Read on every build, current entries end today
+    education, experience, events = get_history()
+
     # Get the earliest event
     earliest = datetime.datetime.today()
     for edu in education:
@@ -176,8 +179,7 @@ def create_background_layout():
     image = dhtml.Img(src='assets/images/body.jpg', className='one-third-column')
 
     # Summary
-    with open('assets/content/summary.md', 'r') as file:
-        summary_md = file.read()
+    summary_md = read_markdown('summary')
     summary = dcore.Markdown(summary_md, className='two-thirds-column', style={'float': 'right', 'align': 'right'})
 
     # Education and Background
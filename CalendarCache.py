@@ -0,0 +1,258 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import hashlib
+import fcntl
+import tempfile
+import threading
+import time
+import urllib.request
+import urllib.error
+import icalendar
+import recurring_ical_events
+from datetime import datetime, timedelta, date
+
+from assets.content.calendar import *
+from Threads import start_thread
+
+# The calendar is downloaded in the background, never while serving a
+# request. The expanded events of the current window are kept in a
+# snapshot file shared by all gunicorn workers, one worker at a time
+# refreshes it (guarded by a file lock) using a conditional GET, and
+# the others just reload it when it changes.
+SNAPSHOT_FILE = os.environ.get('CALENDAR_CACHE_FILE', os.path.join(tempfile.gettempdir(), 'resume-calendar.json'))
+REFRESH_INTERVAL = float(os.environ.get('CALENDAR_REFRESH_INTERVAL', '600'))
+FETCH_TIMEOUT = float(os.environ.get('CALENDAR_FETCH_TIMEOUT', '30'))
+
+_lock = threading.Lock()
+_snapshot = None
+_snapshot_mtime = None
+# The last parsed calendar of this process, with the digest of its source
+_parsed = (None, None)
+
+def calendar_window(today):
+    '''
+    Get the dates shown in the calendar, the start of this week till
+    the end of next week
+
+    Args:
+        today: the current date
+
+    Returns:
+        start_date: the first day shown
+        end_date: the day after the last day shown
+    '''
+    start_date = today - timedelta(days=today.weekday())
+    end_date = start_date + timedelta(days=14)
+    if saturday_first:
+        start_date = start_date - timedelta(days=2)
+        end_date = end_date - timedelta(days=2)
+    return start_date, end_date
+
+def parse_calendar(ical_string):
+    '''
+    Parse a calendar, reusing the last parsed one if the source has not
+    changed
+
+    Args:
+        ical_string: the downloaded ICS file
+
+    Returns:
+        calendar: the parsed icalendar Calendar
+    '''
+    global _parsed
+    digest = hashlib.sha256(ical_string).hexdigest()
+    if _parsed[0] != digest:
+        _parsed = (digest, icalendar.Calendar.from_ical(ical_string))
+    return _parsed[1]
+
+def expand_events(ical_string, start_date, end_date):
+    '''
+    Parse the calendar and expand its (recurring) events in a window
+
+    Args:
+        ical_string: the downloaded ICS file
+        start_date: the first day of the window
+        end_date: the day after the last day of the window
+
+    Returns:
+        events: list of dictionaries with name, start, end and all_day,
+            times are ISO formatted
+    '''
+    calendar = parse_calendar(ical_string)
+    start = (start_date.year, start_date.month, start_date.day)
+    end = (end_date.year, end_date.month, end_date.day)
+    events = []
+    for event in recurring_ical_events.of(calendar).between(start, end):
+        start_time = event['DTSTART'].dt
+        end_time = event['DTEND'].dt
+        if not isinstance(start_time, date):
+            # ????
+            continue
+        events.append({
+            'name': str(event['SUMMARY']),
+            'start': start_time.isoformat(),
+            'end': end_time.isoformat(),
+            'all_day': not isinstance(start_time, datetime)
+        })
+    return events
+
+def _write_snapshot(snapshot, ical_string):
+    '''
+    Atomically replace the snapshot, and the raw calendar next to it
+
+    Args:
+        snapshot: the snapshot dictionary
+        ical_string: the raw calendar, None to keep the current one
+    '''
+    directory = os.path.dirname(SNAPSHOT_FILE) or '.'
+    if ical_string is not None:
+        with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as file:
+            file.write(ical_string)
+        os.replace(file.name, SNAPSHOT_FILE + '.ics')
+    with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as file:
+        json.dump(snapshot, file)
+    os.replace(file.name, SNAPSHOT_FILE)
+
+def _read_json(path):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def refresh():
+    '''
+    Refresh the shared snapshot if it is due, and no other worker is
+    already doing it
+
+    Returns:
+        refreshed: True if this call refreshed the snapshot
+    '''
+    with open(SNAPSHOT_FILE + '.lock', 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        snapshot = _read_json(SNAPSHOT_FILE) or {}
+        start_date, end_date = calendar_window(datetime.now().date())
+        window = start_date.isoformat()
+        if snapshot.get('window') == window and time.time() - snapshot.get('fetched', 0) < REFRESH_INTERVAL:
+            return False
+
+        # A 304 is only useful with the raw calendar to expand again, if it
+        # is missing fetch the whole feed
+        have_raw = os.path.exists(SNAPSHOT_FILE + '.ics')
+        request = urllib.request.Request(calendar_link)
+        if have_raw and snapshot.get('etag'):
+            request.add_header('If-None-Match', snapshot['etag'])
+        if have_raw and snapshot.get('last_modified'):
+            request.add_header('If-Modified-Since', snapshot['last_modified'])
+        ical_string = None
+        try:
+            with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+                ical_string = response.read()
+                snapshot['etag'] = response.headers.get('ETag')
+                snapshot['last_modified'] = response.headers.get('Last-Modified')
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                raise
+        snapshot['fetched'] = time.time()
+        # Servers without conditional GET support send the same feed again
+        if have_raw and ical_string is not None and hashlib.sha256(ical_string).hexdigest() == snapshot.get('digest'):
+            ical_string = None
+
+        # Only expand again if the feed changed, or the week rolled over
+        if ical_string is not None or snapshot.get('window') != window:
+            if ical_string is None:
+                with open(SNAPSHOT_FILE + '.ics', 'rb') as file:
+                    source = file.read()
+            else:
+                source = ical_string
+            snapshot['window'] = window
+            snapshot['digest'] = hashlib.sha256(source).hexdigest()
+            snapshot['events'] = expand_events(source, start_date, end_date)
+            snapshot['version'] = snapshot.get('version', 0) + 1
+        _write_snapshot(snapshot, ical_string)
+        return True
+
+def _refresher():
+    '''
+    Background loop, keeps the snapshot fresh. Errors are printed and the
+    last good snapshot keeps being served.
+    '''
+    while True:
+        try:
+            refresh()
+        except Exception as e:
+            print(e)
+        time.sleep(min(REFRESH_INTERVAL, 60))
+
+def start():
+    '''
+    Start the background refresher of this process, if not running yet
+    '''
+    start_thread('calendar-refresh', _refresher)
+
+def install(server):
+    '''
+    Start the background refresher in every worker before its first
+    request, so the calendar is downloaded before the contact tab is
+    ever shown
+
+    Args:
+        server: the flask server of the app
+    '''
+    server.before_request(start)
+
+def get_snapshot():
+    '''
+    Get the last good snapshot, without any network access. The file is
+    only re-read when another worker has replaced it.
+
+    Returns:
+        snapshot: dictionary with window, events and version, None if
+            the calendar was never downloaded yet
+    '''
+    global _snapshot
+    global _snapshot_mtime
+    start()
+    try:
+        mtime = os.stat(SNAPSHOT_FILE).st_mtime_ns
+    except OSError:
+        return _snapshot
+    if mtime != _snapshot_mtime:
+        with _lock:
+            if mtime != _snapshot_mtime:
+                snapshot = _read_json(SNAPSHOT_FILE)
+                if snapshot is not None and 'events' in snapshot:
+                    _snapshot = snapshot
+                _snapshot_mtime = mtime
+    return _snapshot
+
+def get_version():
+    '''
+    Get the version of the current snapshot, changes whenever the events
+    shown do
+
+    Returns:
+        version: the snapshot version, 0 if there is none yet
+    '''
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return 0
+    return snapshot['version']
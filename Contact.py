@@ -18,13 +18,11 @@ from dash import dcc as dcore
 from dash import html as dhtml
 import plotly.graph_objs as go
 import plotly.colors as co
-import icalendar
-import recurring_ical_events
-import urllib.request
 from datetime import datetime, timedelta, date
 
 from assets.content.location import *
-from assets.content.calendar import *
+from CalendarCache import calendar_window, get_snapshot
+from ContentBundle import read_markdown
 
 def draw_calendar():
     '''
@@ -38,17 +36,11 @@ def draw_calendar():
     # Pick start and end dates to be the start of this week, and
     # the end of next week
     today = datetime.now().date()
-    start_date = today - timedelta(days=today.weekday())
-    end_date = start_date + timedelta(days=14)
-    if saturday_first:
-        start_date = start_date - timedelta(days=2)
-        end_date = end_date - timedelta(days=2)
-    start = (start_date.year, start_date.month, start_date.day)
-    end = (end_date.year, end_date.month, end_date.day)
-    # Download the events
-    ical_string = urllib.request.urlopen(calendar_link).read()
-    calendar = icalendar.Calendar.from_ical(ical_string)
-    events = recurring_ical_events.of(calendar).between(start, end)
+    start_date, end_date = calendar_window(today)
+    # Events come from the background refreshed snapshot, never from
+    # the network, empty until the first download completes
+    snapshot = get_snapshot()
+    events = snapshot['events'] if snapshot is not None else []
     # Make weekdays
     weekdays = []
     day_date = start_date
@@ -73,25 +65,25 @@ def draw_calendar():
     # Colors
     values = {}
     # Convert events to bars
-    heatmap = [[0]*len(weekdays) for i in range(len(hours))]
     for event in events:
-        start_time = event["DTSTART"].dt
-        end_time = event["DTEND"].dt
-        name = event["SUMMARY"]
-        if isinstance(start_time, datetime):
+        name = event['name']
+        if not event['all_day']:
+            start_time = datetime.fromisoformat(event['start'])
+            end_time = datetime.fromisoformat(event['end'])
             day_index = (start_time.date() - start_date).days
             hour_start = (start_time.hour - 8) * 2 + (start_time.minute // 30)
             hour_end = (end_time.hour - 8) * 2 + (end_time.minute // 30)
             text = '<b>' + name + '</b><br>' + start_time.strftime('%a %b %d') + '<br><i>' + start_time.strftime(
                 '%I:%M%p') + ' to ' + end_time.strftime('%I:%M%p') + '</i>'
-        elif isinstance(start_time, date):
+        else:
             # All day events typically show up so
+            start_time = date.fromisoformat(event['start'])
             day_index = (start_time - start_date).days
             hour_start = 3
             hour_end = 23
             text = '<b>' + name + '</b><br>' + start_time.strftime('%a %b %d') + '<br><i> 9:30AM to 7:30PM</i>'
-        else:
-            # ????
+        if day_index < 0 or day_index >= len(weekdays):
+            # Snapshot from an older window
             continue
         if name not in values:
             values[name] = ([day_index], [hour_start], [hour_end - hour_start], [text])
@@ -103,18 +95,18 @@ def draw_calendar():
     # Plot
     data = []
     color = 0
+    # One trace per event name, holding all its occurrences
     for name in values:
-        for i in range(len(values[name][0])):
-            data.append(go.Bar(
-                name=name,
-                x=[values[name][0][i]],
-                y=[values[name][2][i]],
-                base=[values[name][1][i]],
-                hoverinfo='text',
-                hovertext=[values[name][3][i]],
-                showlegend=False,
-                marker_color=co.DEFAULT_PLOTLY_COLORS[color % len(co.DEFAULT_PLOTLY_COLORS)]
-            ))
+        data.append(go.Bar(
+            name=name,
+            x=values[name][0],
+            y=values[name][2],
+            base=values[name][1],
+            hoverinfo='text',
+            hovertext=values[name][3],
+            showlegend=False,
+            marker_color=co.DEFAULT_PLOTLY_COLORS[color % len(co.DEFAULT_PLOTLY_COLORS)]
+        ))
         color += 1
     layout = dict(
         barmode='overlay',
@@ -193,12 +185,11 @@ def create_contact_layout():
     '''
 
     # Info
-    with open('assets/content/contact.md', 'r') as file:
-        contact_md = file.read()
+    contact_md = read_markdown('contact')
     info = dcore.Markdown(contact_md, className='one-half-column', style={'float': 'left', 'align': 'left'})
 
     # Calendar
-    calendar = dcore.Graph(figure=draw_calendar(), className='one-half-row')
+    calendar = dcore.Graph(id='calendar', figure=draw_calendar(), className='one-half-row')
 
     # Map
     work_map = dcore.Graph(figure=draw_map(), className='one-half-row')
@@ -0,0 +1,518 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import datetime
+import importlib
+import importlib.metadata
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# All the content under assets/content is compiled, after validation,
+# into a single bundle file: the markdown, the flattened history and
+# skill tables, and the ready to send payloads of every tab that never
+# changes. The server memory maps the bundle at boot, so nothing is
+# parsed and the tabs are never built. The bundle holds the digest of
+# the sources and code it was compiled from, a bundle older than either
+# is ignored and everything is read from the sources instead.
+# 
+# Layout: MAGIC, the header length (8 bytes little endian), the header
+# as JSON, then the sections. The header maps every section name to its
+# offset and length.
+BUNDLE_FILE = os.environ.get('CONTENT_BUNDLE', 'content.bundle')
+CONTENT = 'assets/content'
+MAGIC = b'RESUMEB\x01'
+FORMAT = 3
+MARKDOWN = ['name', 'summary', 'work', 'publications', 'teaching', 'contact']
+MODULES = ['history', 'skills', 'links', 'location', 'calendar']
+# The code turning the content into the bundled tables and payloads, and
+# the libraries it uses. A bundle compiled by other versions of them is
+# ignored too.
+CODE = ['Background.py', 'Work.py', 'Publications.py', 'Teaching.py', 'Skills.py', 'Tabs.py', 'TabCache.py',
+        'ContentBundle.py', 'Resume.py']
+LIBRARIES = ['dash', 'plotly', 'brotli']
+
+class ContentError(ValueError):
+    '''
+    The content does not match its schema, lists every problem found
+    '''
+    def __init__(self, problems):
+        super().__init__('Invalid content:\n  ' + '\n  '.join(problems))
+        self.problems = problems
+
+def get_sources():
+    '''
+    Get the content files the bundle is compiled from
+
+    Returns:
+        paths: the sorted list of paths
+    '''
+    return sorted([os.path.join(CONTENT, name + '.md') for name in MARKDOWN] +
+                  [os.path.join(CONTENT, name + '.py') for name in MODULES])
+
+def get_digest():
+    '''
+    Hash the content sources, the code compiling them and the library
+    versions, changes whenever any of them does
+
+    Returns:
+        digest: the sha256 hex digest
+    '''
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    paths = [(path, path) for path in get_sources()] + [(name, os.path.join(directory, name)) for name in CODE]
+    for name, path in paths:
+        with open(path, 'rb') as file:
+            digest.update(name.encode('utf-8') + b'\0' + file.read() + b'\0')
+    for name in LIBRARIES:
+        try:
+            version = importlib.metadata.version(name)
+        except importlib.metadata.PackageNotFoundError:
+            version = ''
+        digest.update(name.encode('utf-8') + b'\0' + version.encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+def _check_entries(name, entries, problems):
+    if not isinstance(entries, list):
+        problems.append(name + ': must be a list')
+        return
+    for i, entry in enumerate(entries):
+        where = name + '[' + str(i) + ']'
+        if not isinstance(entry, dict):
+            problems.append(where + ': must be a dictionary')
+            continue
+        for key in ('name', 'location'):
+            if not isinstance(entry.get(key), str) or not entry.get(key):
+                problems.append(where + '.' + key + ': must be a non empty string')
+        for key in ('start', 'end'):
+            if not isinstance(entry.get(key), datetime.datetime):
+                problems.append(where + '.' + key + ': must be a datetime')
+        if isinstance(entry.get('start'), datetime.datetime) and isinstance(entry.get('end'), datetime.datetime) \
+           and entry['start'] > entry['end']:
+            problems.append(where + ': starts after it ends')
+
+def _check_events(events, problems):
+    if not isinstance(events, list):
+        problems.append('history.events: must be a list')
+        return
+    for i, event in enumerate(events):
+        where = 'history.events[' + str(i) + ']'
+        if not isinstance(event, dict):
+            problems.append(where + ': must be a dictionary')
+            continue
+        if not isinstance(event.get('what'), str) or not event.get('what'):
+            problems.append(where + '.what: must be a non empty string')
+        if not isinstance(event.get('when'), datetime.datetime):
+            problems.append(where + '.when: must be a datetime')
+
+def skill_id(parent, name):
+    '''
+    Get the id of a skill tree node, the path of labels separated by /.
+    Labels may contain / themselves, so / and \\ in them are escaped with
+    \\, and no two nodes ever share an id.
+
+    Args:
+        parent: the id of the parent node, empty for the top level
+        name: the label of the node
+
+    Returns:
+        node_id: the id of the node
+    '''
+    name = name.replace('\\', '\\\\').replace('/', '\\/')
+    return parent + '/' + name if parent else name
+
+def _check_skills(skills, path, problems, ids=None):
+    if ids is None:
+        ids = set()
+    if not isinstance(skills, dict) or not skills:
+        problems.append('skills' + path + ': must be a non empty dictionary')
+        return
+    for name, value in skills.items():
+        if not isinstance(name, str) or not name:
+            problems.append('skills' + path + ': ' + repr(name) + ' must be a non empty string')
+            continue
+        node_id = skill_id(path.lstrip('/'), name)
+        if node_id in ids:
+            problems.append('skills/' + node_id + ': is defined twice')
+        ids.add(node_id)
+        if isinstance(value, dict):
+            _check_skills(value, '/' + node_id, problems, ids)
+        elif isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= 100:
+            problems.append('skills' + path + '/' + name + ': must be a number from 0 to 100')
+
+def validate(modules, markdown):
+    '''
+    Check the content against its schema
+
+    Args:
+        modules: dictionary of content module name to module
+        markdown: dictionary of markdown name to text
+
+    Raises:
+        ContentError: listing every problem found
+    '''
+    problems = []
+    for name, text in markdown.items():
+        if not text.strip():
+            problems.append(name + '.md: is empty')
+    history = modules['history']
+    _check_entries('history.education', getattr(history, 'education', None), problems)
+    _check_entries('history.experience', getattr(history, 'experience', None), problems)
+    _check_events(getattr(history, 'events', None), problems)
+    _check_skills(getattr(modules['skills'], 'skills', None), '', problems)
+    for name in ('github_link', 'scholar_link', 'linkedin_link', 'stackof_link', 'resume_link'):
+        value = getattr(modules['links'], name, None)
+        if not isinstance(value, str) or not value.startswith(('http://', 'https://')):
+            problems.append('links.' + name + ': must be an http(s) URL')
+    if not isinstance(getattr(modules['links'], 'email_link', None), str) or '@' not in modules['links'].email_link:
+        problems.append('links.email_link: must be an email address')
+    location = modules['location']
+    for name, bound in (('latitude', 90), ('longitude', 180)):
+        value = getattr(location, name, None)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not -bound <= value <= bound:
+            problems.append('location.' + name + ': must be a number from ' + str(-bound) + ' to ' + str(bound))
+    if not isinstance(getattr(location, 'address_simple', None), str):
+        problems.append('location.address_simple: must be a string')
+    calendar = modules['calendar']
+    if not isinstance(getattr(calendar, 'calendar_link', None), str) or \
+       not calendar.calendar_link.startswith(('http://', 'https://')):
+        problems.append('calendar.calendar_link: must be an http(s) URL')
+    if not isinstance(getattr(calendar, 'saturday_first', None), bool):
+        problems.append('calendar.saturday_first: must be True or False')
+    if problems:
+        raise ContentError(problems)
+
+def flatten_history(entries):
+    '''
+    Convert history entries to JSON friendly rows. Current entries end
+    today in the content (datetime.today()), they are marked as current
+    and end at whatever today is when loaded. Any other end is kept, even
+    a future one.
+
+    Args:
+        entries: list of history dictionaries
+
+    Returns:
+        rows: list of dictionaries with ISO formatted dates, and whether
+            the entry is current
+    '''
+    today = datetime.datetime.today().date()
+    return [{'name': entry['name'], 'location': entry['location'], 'start': entry['start'].isoformat(),
+             'end': entry['end'].isoformat(), 'current': entry['end'].date() == today} for entry in entries]
+
+def history_table(history):
+    '''
+    Convert the history content to a JSON friendly table
+
+    Args:
+        history: the history content module
+
+    Returns:
+        table: dictionary of education and experience rows (see
+            flatten_history), and events with ISO formatted dates
+    '''
+    return {'education': flatten_history(history.education),
+            'experience': flatten_history(history.experience),
+            'events': [{'what': event['what'], 'when': event['when'].isoformat()} for event in history.events]}
+
+def compile_bundle(path=BUNDLE_FILE):
+    '''
+    Validate the content, and compile it to a bundle
+
+    Args:
+        path: the bundle file to write
+
+    Returns:
+        sections: the number of sections written
+    '''
+    modules = {name: importlib.import_module('assets.content.' + name) for name in MODULES}
+    markdown = {}
+    for name in MARKDOWN:
+        with open(os.path.join(CONTENT, name + '.md'), 'r') as file:
+            markdown[name] = file.read()
+    validate(modules, markdown)
+
+    sections = {}
+    for name, text in markdown.items():
+        sections['markdown/' + name] = text.encode('utf-8')
+    sections['tables/history'] = json.dumps(history_table(modules['history'])).encode('utf-8')
+
+    # Only now import the app, the tables and tabs come from its code
+    from Skills import SKILL_TREE, SKILL_INDEX, draw_skills
+    from plotly.io.json import to_json_plotly
+    import Resume
+    from Tabs import iter_tabs
+    from TabCache import Payload
+    sections['tables/skills'] = json.dumps({'tree': SKILL_TREE, 'index': SKILL_INDEX}).encode('utf-8')
+    sections['figures/skills'] = to_json_plotly(draw_skills()).encode('utf-8')
+    for tab in iter_tabs():
+        # Tabs that expire or follow a version change after compiling
+        if tab.expiry is not None or tab.version is not None:
+            continue
+        payload = Payload.build(tab.get()[0], 0)
+        prefix = 'tabs/' + tab.value + '/'
+        sections[prefix + 'body'] = payload.body
+        sections[prefix + 'response'] = payload.response
+        sections[prefix + 'body.gz'] = payload.body_gzip
+        sections[prefix + 'response.gz'] = payload.gzip
+        if brotli is not None:
+            sections[prefix + 'body.br'] = payload.body_brotli
+            sections[prefix + 'response.br'] = payload.brotli
+
+    header = {'format': FORMAT, 'digest': get_digest(), 'compiled': datetime.datetime.now().isoformat(),
+              'sections': {}}
+    offset = 0
+    for name, data in sections.items():
+        header['sections'][name] = [offset, len(data)]
+        offset += len(data)
+    header = json.dumps(header).encode('utf-8')
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as file:
+        file.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        for data in sections.values():
+            file.write(data)
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, path)
+    return len(sections)
+
+class SectionFile:
+    '''
+    A bundle section as a binary file, positioned at the start of the
+    section and ending with it. Sent through wsgi.file_wrapper, servers
+    with sendfile (gunicorn) send it straight from the page cache the
+    mapping shares, others read it in chunks.
+    '''
+    mode = 'rb'
+
+    def __init__(self, file, length):
+        self._file = file
+        self._left = length
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._left:
+            size = self._left
+        data = self._file.read(size)
+        self._left -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+class Bundle:
+    '''
+    A compiled content bundle, memory mapped. Sections are handed out as
+    views of the mapping, nothing is copied until used.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(file.fileno())
+            self._inode = (stat.st_dev, stat.st_ino)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(path + ' is not a content bundle')
+        start = len(MAGIC) + 8
+        length = struct.unpack('<Q', self._map[len(MAGIC):start])[0]
+        self.header = json.loads(self._map[start:start + length])
+        if self.header['format'] != FORMAT:
+            raise ValueError(path + ' has bundle format ' + str(self.header['format']) + ', expected ' + str(FORMAT))
+        self._data = start + length
+        self._view = memoryview(self._map)
+
+    @property
+    def digest(self):
+        '''
+        The digest of the content and code the bundle was compiled from
+        '''
+        return self.header['digest']
+
+    def get(self, name):
+        '''
+        Get a section
+
+        Args:
+            name: the section name
+
+        Returns:
+            data: a memoryview of the section, None if missing
+        '''
+        section = self.header['sections'].get(name)
+        if section is None:
+            return None
+        offset = self._data + section[0]
+        return self._view[offset:offset + section[1]]
+
+    def open(self, name):
+        '''
+        Open a section as a file, to send it without copying
+
+        Args:
+            name: the section name
+
+        Returns:
+            file: the SectionFile, None if the section is missing or the
+                bundle was compiled again since it was mapped
+        '''
+        section = self.header['sections'].get(name)
+        if section is None:
+            return None
+        try:
+            file = open(self.path, 'rb')
+        except OSError:
+            return None
+        stat = os.fstat(file.fileno())
+        if (stat.st_dev, stat.st_ino) != self._inode:
+            file.close()
+            return None
+        file.seek(self._data + section[0])
+        return SectionFile(file, section[1])
+
+    def get_text(self, name):
+        '''
+        Get a text section, None if missing
+        '''
+        data = self.get(name)
+        return None if data is None else str(data, 'utf-8')
+
+    def get_json(self, name):
+        '''
+        Get a JSON section, decoded, None if missing
+        '''
+        data = self.get(name)
+        return None if data is None else json.loads(str(data, 'utf-8'))
+
+def load_bundle(path=BUNDLE_FILE):
+    '''
+    Map the bundle if there is one, and it is up to date
+
+    Args:
+        path: the bundle file
+
+    Returns:
+        bundle: the Bundle, None to read the content sources instead
+    '''
+    if not os.path.exists(path):
+        return None
+    try:
+        bundle = Bundle(path)
+    except (OSError, ValueError) as e:
+        print(e)
+        return None
+    if bundle.digest != get_digest():
+        print(path + ' is older than the content or the code, ignored. Run python3 ContentBundle.py to compile it again.')
+        return None
+    return bundle
+
+_bundle = None
+_loaded = False
+
+def get_bundle():
+    '''
+    Get the bundle, mapped on first use, when the app modules are
+    imported at boot
+
+    Returns:
+        bundle: the Bundle, None if there is none or it is outdated
+    '''
+    global _bundle
+    global _loaded
+    if not _loaded:
+        _bundle = load_bundle()
+        _loaded = True
+    return _bundle
+
+def disable():
+    '''
+    Never use a bundle in this process, read the content sources instead
+    '''
+    global _bundle
+    global _loaded
+    _bundle = None
+    _loaded = True
+
+def read_markdown(name):
+    '''
+    Get a markdown content file, from the bundle if possible
+
+    Args:
+        name: the file name, without the .md extension
+
+    Returns:
+        text: the markdown
+    '''
+    bundle = get_bundle()
+    if bundle is not None:
+        text = bundle.get_text('markdown/' + name)
+        if text is not None:
+            return text
+    with open(os.path.join(CONTENT, name + '.md'), 'r') as file:
+        return file.read()
+
+# The history module with its table. Current entries end on the day the
+# module was loaded, its table is made then to tell them apart.
+_history = (None, None)
+
+def get_history():
+    '''
+    Get the education and experience entries, and the events, from the
+    bundle if possible. Current entries end today, whenever it is called.
+
+    Returns:
+        education: list of dictionaries with name, location, start and end
+        experience: list of dictionaries with name, location, start and end
+        events: list of dictionaries with what and when
+    '''
+    global _history
+    bundle = get_bundle()
+    if bundle is not None:
+        tables = bundle.get_json('tables/history')
+    else:
+        history = importlib.import_module('assets.content.history')
+        if _history[0] is not history:
+            _history = (history, history_table(history))
+        tables = _history[1]
+    today = datetime.datetime.today()
+    lists = []
+    for key in ('education', 'experience'):
+        lists.append([{'name': row['name'], 'location': row['location'],
+                       'start': datetime.datetime.fromisoformat(row['start']),
+                       'end': today if row['current'] else datetime.datetime.fromisoformat(row['end'])}
+                      for row in tables[key]])
+    events = [{'what': row['what'], 'when': datetime.datetime.fromisoformat(row['when'])} for row in tables['events']]
+    return lists[0], lists[1], events
+
+if __name__ == '__main__':
+    # The app imports this file as ContentBundle, not __main__, and the
+    # bundle being replaced must not be used by it
+    import ContentBundle
+    ContentBundle.disable()
+    try:
+        count = ContentBundle.compile_bundle(sys.argv[1] if len(sys.argv) > 1 else BUNDLE_FILE)
+    except ContentBundle.ContentError as e:
+        print(e)
+        sys.exit(1)
+    print('Compiled ' + str(count) + ' sections')
@@ -0,0 +1,221 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+import importlib
+
+import ContentBundle
+import TabCache
+from Tabs import iter_tabs
+from Threads import start_thread, is_started
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+# Content edits are picked up without a restart. Every worker watches
+# assets/content, with inotify if inotify_simple is installed, or by
+# polling the modification times every WATCH_INTERVAL seconds. A changed
+# file only rebuilds the tabs depending on it, in the background: the
+# old layout keeps being served until the new one replaces it, and a
+# change that fails validation is never applied. The page shell (name.md
+# and links.py) already follows its files, see Resume.SHELL.
+WATCH_ENABLED = os.environ.get('CONTENT_WATCH', '1') not in ('', '0')
+WATCH_INTERVAL = float(os.environ.get('CONTENT_WATCH_INTERVAL', '2'))
+# Editors save in several steps, changes this close are applied together
+SETTLE_TIME = 0.2
+# Content file to the values of the tabs built from it
+DEPENDENCIES = {
+    'summary.md': ['1'],
+    'history.py': ['1'],
+    'work.md': ['2'],
+    'publications.md': ['3'],
+    'teaching.md': ['4'],
+    'skills.py': ['5'],
+    'contact.md': ['6'],
+    'location.py': ['6'],
+    'calendar.py': ['6']
+}
+# Content module to the app modules that star imported its names
+BINDINGS = {
+    'location': ['Contact'],
+    'calendar': ['CalendarCache']
+}
+
+_stats = {'mode': None, 'changes': 0, 'rejected': 0, 'last_change': None, 'last_error': None, 'rebuilds': {}}
+
+def _refresh_skills():
+    skills = sys.modules.get('Skills')
+    if skills is not None:
+        skills.load_skills()
+
+# Content module to the function taking it into use, for the ones that
+# are not star imported nor read on every build
+REFRESHERS = {
+    'skills': _refresh_skills
+}
+
+def scan():
+    '''
+    Get the modification times of the watched content files
+
+    Returns:
+        mtimes: dictionary of file name to modification time, None for
+            a missing file
+    '''
+    mtimes = {}
+    for name in DEPENDENCIES:
+        try:
+            mtimes[name] = os.stat(os.path.join(ContentBundle.CONTENT, name)).st_mtime_ns
+        except OSError:
+            mtimes[name] = None
+    return mtimes
+
+def _bind(module):
+    names = getattr(module, '__all__', None)
+    if names is None:
+        names = [name for name in vars(module) if not name.startswith('_')]
+    for app_name in BINDINGS.get(module.__name__.rsplit('.', 1)[-1], []):
+        app_module = sys.modules.get(app_name)
+        if app_module is not None:
+            for name in names:
+                setattr(app_module, name, getattr(module, name))
+
+def apply(names):
+    '''
+    Take changed content files into use. The whole content is validated
+    first, nothing is applied if it is invalid. Then the content bundle
+    is dropped, as it no longer matches the sources, and only the tabs
+    depending on the changed files are rebuilt and serialized.
+
+    Args:
+        names: list of the changed file names
+
+    Returns:
+        tabs: list of the values of the rebuilt tabs
+
+    Raises:
+        ContentError: if the content is invalid
+    '''
+    modules = {}
+    for name in ContentBundle.MODULES:
+        module = importlib.import_module('assets.content.' + name)
+        if name + '.py' in names:
+            module = importlib.reload(module)
+        modules[name] = module
+    markdown = {}
+    for name in ContentBundle.MARKDOWN:
+        with open(os.path.join(ContentBundle.CONTENT, name + '.md'), 'r') as file:
+            markdown[name] = file.read()
+    ContentBundle.validate(modules, markdown)
+
+    ContentBundle.disable()
+    for name, module in modules.items():
+        if name + '.py' in names:
+            _bind(module)
+            if name in REFRESHERS:
+                REFRESHERS[name]()
+    tabs = {tab.value: tab for tab in iter_tabs()}
+    values = sorted(set(value for name in names for value in DEPENDENCIES.get(name, [])))
+    for value in values:
+        if value in tabs:
+            # Swapped in once built, requests meanwhile get the old layout.
+            # Serialized here too, so no request waits for it.
+            tabs[value].rebuild()
+            TabCache.forget_bundle(value)
+            TabCache.get_payload(value)
+            _stats['rebuilds'][value] = _stats['rebuilds'].get(value, 0) + 1
+    return values
+
+def _apply_safely(names):
+    _stats['changes'] += 1
+    _stats['last_change'] = time.time()
+    try:
+        values = apply(names)
+        print('Content changed (' + ', '.join(names) + '), rebuilt tabs ' + ', '.join(values))
+    except Exception as e:
+        _stats['rejected'] += 1
+        _stats['last_error'] = str(e)
+        print('Content change (' + ', '.join(names) + ') not applied: ' + str(e))
+
+def _poll():
+    '''
+    Background loop, compares the modification times every
+    WATCH_INTERVAL seconds
+    '''
+    mtimes = scan()
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        current = scan()
+        if current != mtimes:
+            time.sleep(SETTLE_TIME)
+            current = scan()
+            changed = sorted(name for name in current if current[name] != mtimes.get(name))
+            mtimes = current
+            if changed:
+                _apply_safely(changed)
+
+def _watch():
+    '''
+    Background loop, waits for inotify events on the content directory.
+    Saving through a temporary file and a rename is caught too.
+    '''
+    watcher = inotify_simple.INotify()
+    flags = inotify_simple.flags
+    watcher.add_watch(ContentBundle.CONTENT, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+    while True:
+        events = watcher.read(read_delay=int(SETTLE_TIME * 1000))
+        changed = sorted(set(event.name for event in events if event.name in DEPENDENCIES))
+        if changed:
+            _apply_safely(changed)
+
+def _watcher():
+    if inotify_simple is not None:
+        try:
+            _stats['mode'] = 'inotify'
+            _watch()
+        except OSError as e:
+            print('inotify failed, polling the content instead: ' + str(e))
+    _stats['mode'] = 'polling'
+    _poll()
+
+def start():
+    '''
+    Start watching the content in this process, if not watching yet
+    '''
+    if WATCH_ENABLED:
+        start_thread('content-watch', _watcher)
+
+def install(server):
+    '''
+    Start watching the content in every worker, on its first request
+
+    Args:
+        server: the flask server of the app
+    '''
+    server.before_request(start)
+
+def get_stats():
+    '''
+    Get the content watching statistics of this process
+
+    Returns:
+        stats: dictionary with the watching mode, the number of changes
+            seen and rejected, the last error, and the rebuilds of every tab
+    '''
+    return dict(_stats, watching=is_started('content-watch'))
@@ -0,0 +1,199 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import queue
+import threading
+import time
+import pymysql
+from contextlib import contextmanager
+
+# Every process keeps a small pool of open connections, instead of
+# connecting (TCP and auth handshake) on every query. Sockets cannot
+# be shared between forked gunicorn workers, so the pool is dropped
+# in the child after a fork and refilled lazily.
+POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', '4'))
+POOL_TIMEOUT = float(os.environ.get('DATABASE_POOL_TIMEOUT', '10'))
+# Connections idle for longer than this are pinged before reuse
+POOL_RECYCLE = float(os.environ.get('DATABASE_POOL_RECYCLE', '60'))
+
+class ConnectionPool:
+    '''
+    A bounded pool of MySQL connections. At most size connections are
+    open at a time, callers wait for a free one otherwise.
+    '''
+    def __init__(self, size, timeout, recycle):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self._setup()
+
+    def _setup(self):
+        '''
+        Reset the pool state, used on creation and after a fork
+        '''
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._stats = {
+            'acquired': 0,
+            'created': 0,
+            'reconnected': 0,
+            'timeouts': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0
+        }
+
+    def _connect(self):
+        '''
+        Open a new connection using the database environment variables
+
+        Returns:
+            con: the new connection
+        '''
+        con = pymysql.connect(host=os.environ.get('DATABASE_HOSTNAME'), user=os.environ.get('DATABASE_USERNAME'), password=os.environ.get('DATABASE_PASSWORD'), db=os.environ.get('DATABASE_SCHEMA'))
+        with self._lock:
+            self._stats['created'] += 1
+        return con
+
+    def _check(self, con, last_used):
+        '''
+        Make sure an idle connection is still alive, reconnect if not
+
+        Args:
+            con: the connection taken from the pool
+            last_used: when the connection was returned to the pool
+
+        Returns:
+            con: a usable connection
+        '''
+        if time.monotonic() - last_used < self.recycle:
+            return con
+        try:
+            con.ping(reconnect=False)
+            return con
+        except pymysql.Error:
+            self._close(con)
+        with self._lock:
+            self._stats['reconnected'] += 1
+        return self._connect()
+
+    def _close(self, con):
+        try:
+            con.close()
+        except pymysql.Error:
+            pass
+
+    def acquire(self):
+        '''
+        Take a connection from the pool, waiting if all are in use
+
+        Returns:
+            con: the connection, must be given back with release
+        '''
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise pymysql.OperationalError('Timed out waiting for a database connection')
+        wait = time.monotonic() - start
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['wait_total'] += wait
+            self._stats['wait_max'] = max(self._stats['wait_max'], wait)
+        try:
+            try:
+                con, last_used = self._idle.get_nowait()
+                return self._check(con, last_used)
+            except queue.Empty:
+                return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, con, broken=False):
+        '''
+        Give a connection back to the pool. Its transaction is rolled
+        back, so uncommitted changes are dropped and the next borrower
+        does not read from an old snapshot.
+
+        Args:
+            con: the connection taken by acquire
+            broken: close the connection instead of reusing it
+        '''
+        if not broken and con.open:
+            try:
+                con.rollback()
+            except pymysql.Error:
+                broken = True
+        if broken or not con.open:
+            self._close(con)
+        else:
+            self._idle.put((con, time.monotonic()))
+        self._slots.release()
+
+    def after_fork(self):
+        '''
+        Forget the parent's connections in a freshly forked child. They
+        are not closed, the parent is still using them.
+        '''
+        self._setup()
+
+    def get_stats(self):
+        '''
+        Get the pool statistics of this process
+
+        Returns:
+            stats: dictionary of pool usage and pool wait time
+        '''
+        with self._lock:
+            stats = dict(self._stats)
+        stats['size'] = self.size
+        stats['idle'] = self._idle.qsize()
+        stats['wait_avg'] = stats['wait_total'] / stats['acquired'] if stats['acquired'] else 0.0
+        del stats['wait_total']
+        return stats
+
+POOL = ConnectionPool(POOL_SIZE, POOL_TIMEOUT, POOL_RECYCLE)
+os.register_at_fork(after_in_child=POOL.after_fork)
+
+@contextmanager
+def connection():
+    '''
+    Borrow a pooled connection for a with block. Whatever the block did
+    not commit is rolled back, the connection is dropped if it is no
+    longer usable.
+
+    Returns:
+        con: the pooled connection
+    '''
+    con = POOL.acquire()
+    broken = False
+    try:
+        yield con
+    except Exception as e:
+        broken = isinstance(e, (pymysql.OperationalError, pymysql.InterfaceError))
+        raise
+    finally:
+        POOL.release(con, broken)
+
+def get_stats():
+    '''
+    Get the connection pool statistics of this process
+
+    Returns:
+        stats: dictionary of pool usage and pool wait time
+    '''
+    return POOL.get_stats()
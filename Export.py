@@ -0,0 +1,250 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import csv
+import io
+import os
+import threading
+import flask
+import pymysql
+from datetime import date, timedelta
+
+from Database import connection
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# The visits are streamed out with an unbuffered server side cursor,
+# EXPORT_BATCH rows at a time, so an export never holds more than one
+# batch in memory however big the table is. An export holds a pooled
+# connection until it is done, at most EXPORT_LIMIT run at a time in
+# every worker so the site is never left without connections. Archived
+# visits (see Rollup.py) are exported too.
+# Exports need the /_stats token, see Resume.py.
+EXPORT_BATCH = int(os.environ.get('EXPORT_BATCH', '10000'))
+EXPORT_LIMIT = int(os.environ.get('EXPORT_LIMIT', '1'))
+COLUMNS = ['Date and Time', 'Country', 'State', 'City', 'Postal', 'Longitude', 'Latitude', 'Visits']
+# Same columns as the visitors table, IPs are never exported
+SELECT_SQL = ("SELECT v.bucket, IF(c.name = 'Israel', 'Palestine', c.name), v.state, v.city, v.postal, "
+              'v.longitude, v.latitude, v.visits FROM {} v JOIN countries c ON c.id = v.country_id')
+TABLES = ['visits_archive', 'visits']
+
+_exports = threading.BoundedSemaphore(EXPORT_LIMIT)
+
+def export_query(start=None, end=None, country=None):
+    '''
+    Create the export query, the filters are left to the database
+
+    Args:
+        start: the first day, None for no limit
+        end: the last day, None for no limit
+        country: only visits from this country, None for all
+
+    Returns:
+        sql: the query
+        params: the query parameters
+    '''
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append('v.bucket >= %s')
+        params.append(start)
+    if end is not None:
+        conditions.append('v.bucket < %s')
+        params.append(end + timedelta(days=1))
+    if country is not None:
+        names = [country, 'Israel'] if country == 'Palestine' else [country]
+        conditions.append('c.name IN (' + ', '.join(['%s'] * len(names)) + ')')
+        params.extend(names)
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    # One statement, so visits archived during the export are not missed
+    sql = ' UNION ALL '.join(SELECT_SQL.format(table) + where for table in TABLES)
+    return sql + ' ORDER BY bucket', params * len(TABLES)
+
+def stream_rows(sql, params):
+    '''
+    Run a query on a server side cursor, and yield its rows in batches.
+    The pooled connection is closed if the stream is abandoned, it still
+    has unread rows.
+
+    Args:
+        sql: the query
+        params: the query parameters
+
+    Returns:
+        batches: generator of lists of at most EXPORT_BATCH rows
+    '''
+    with connection() as con:
+        done = False
+        try:
+            db = con.cursor(pymysql.cursors.SSCursor)
+            db.execute(sql, params)
+            while True:
+                rows = db.fetchmany(EXPORT_BATCH)
+                if not rows:
+                    break
+                yield rows
+            db.close()
+            done = True
+        finally:
+            if not done:
+                try:
+                    con.close()
+                except pymysql.Error:
+                    pass
+
+def stream_csv(batches):
+    '''
+    Encode batches of rows as CSV, with a header
+
+    Args:
+        batches: generator of lists of rows
+
+    Returns:
+        chunks: generator of CSV chunks, one per batch
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows((row[0].strftime('%Y-%m-%d %H:%M'),) + row[1:] for row in rows)
+        yield buffer.getvalue()
+
+class _Sink:
+    '''
+    A write only file handing out whatever was written so far, used to
+    stream a Parquet file as it is written
+    '''
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_parquet(batches):
+    '''
+    Encode batches of rows as a Parquet file, one row group per batch
+
+    Args:
+        batches: generator of lists of rows
+
+    Returns:
+        chunks: generator of the bytes of the file, one chunk per row group
+    '''
+    schema = pyarrow.schema([
+        ('time', pyarrow.timestamp('s')),
+        ('country', pyarrow.string()),
+        ('state', pyarrow.string()),
+        ('city', pyarrow.string()),
+        ('postal', pyarrow.string()),
+        ('longitude', pyarrow.float64()),
+        ('latitude', pyarrow.float64()),
+        ('visits', pyarrow.int64())
+    ])
+    sink = _Sink()
+    writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'), schema)
+    for rows in batches:
+        columns = list(zip(*rows))
+        columns[5] = [float(value) for value in columns[5]]
+        columns[6] = [float(value) for value in columns[6]]
+        writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(column, type=field.type)
+                                                      for column, field in zip(columns, schema)], schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+def _parse_day(name):
+    value = flask.request.args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        flask.abort(400, 'Invalid ' + name + ' date, use YYYY-MM-DD')
+
+_allowed = None
+
+def _export(extension):
+    '''
+    Flask route streaming the visits, filtered by the start, end and
+    country query arguments
+
+    Args:
+        extension: either csv or parquet
+
+    Returns:
+        response: the streamed file
+    '''
+    if _allowed is None or not _allowed():
+        flask.abort(403)
+    if extension not in ('csv', 'parquet'):
+        flask.abort(404)
+    if extension == 'parquet' and pyarrow is None:
+        flask.abort(501, 'Parquet export needs pyarrow')
+    sql, params = export_query(_parse_day('start'), _parse_day('end'), flask.request.args.get('country') or None)
+    if not _exports.acquire(blocking=False):
+        flask.abort(429, 'Another export is running, try again later')
+
+    def generate():
+        batches = stream_rows(sql, params)
+        if extension == 'csv':
+            for chunk in stream_csv(batches):
+                yield chunk.encode('utf-8')
+        else:
+            yield from stream_parquet(batches)
+
+    mimetype = 'text/csv' if extension == 'csv' else 'application/vnd.apache.parquet'
+    response = flask.Response(generate(), mimetype=mimetype)
+    # Called once the response is done, or abandoned by the client
+    response.call_on_close(_exports.release)
+    response.headers['Content-Disposition'] = 'attachment; filename=visitors.' + extension
+    return response
+
+def install(server, allowed):
+    '''
+    Serve the visits at /_export/visitors.csv and /_export/visitors.parquet
+
+    Args:
+        server: the flask server of the app
+        allowed: function telling whether the current request may
+            export the visits
+    '''
+    global _allowed
+    _allowed = allowed
+    server.add_url_rule('/_export/visitors.<extension>', 'export', _export)
@@ -0,0 +1,220 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import csv
+import json
+import ipaddress
+import numpy
+
+# An offline IP to location database. A CSV of IP ranges is compiled
+# once into a directory of sorted numpy arrays, which are memory mapped
+# so all gunicorn workers share the same pages. IPv6 addresses do not
+# fit in one integer, so they are split into high and low 64 bit halves.
+# 
+# The CSV has one range per line:
+#   ip_from,ip_to,country,state,city,postal,latitude,longitude
+# where ip_from and ip_to are either addresses or integers. Integer
+# ranges ending past 2 ** 32 are IPv6, as are all of them in a CSV
+# compiled with --ipv6. IPv6 databases hold IPv4 as IPv4 mapped addresses
+# (::ffff:0:0/96), those ranges are moved to the IPv4 arrays, where IPv4
+# lookups search.
+ARRAYS = ['v4_start', 'v4_end', 'v4_location', 'v6_start_hi', 'v6_start_lo',
+          'v6_end_hi', 'v6_end_lo', 'v6_location']
+MASK = (1 << 64) - 1
+V4_MAX = 0xFFFFFFFF
+V4_MAPPED = int(ipaddress.ip_address('::ffff:0.0.0.0'))
+
+def parse_address(value):
+    '''
+    Parse one end of a range
+
+    Args:
+        value: the address, or its integer value
+
+    Returns:
+        version: 4 or 6, None for an integer
+        number: the integer value of the address
+    '''
+    value = value.strip()
+    if value.isdigit():
+        return None, int(value)
+    address = ipaddress.ip_address(value)
+    return address.version, int(address)
+
+def parse_range(first, last, ipv6=False):
+    '''
+    Parse a range, split into its IPv4 and IPv6 parts
+
+    Args:
+        first: the first address of the range, or its integer value
+        last: the last address of the range, or its integer value
+        ipv6: integers are IPv6 addresses, whatever their value
+
+    Returns:
+        ranges: list of (version, start, end) tuples
+
+    Raises:
+        ValueError: if the range can not be parsed
+    '''
+    start_version, start = parse_address(first)
+    end_version, end = parse_address(last)
+    if start_version is None and end_version is None:
+        version = 6 if ipv6 or end > V4_MAX else 4
+    elif start_version is not None and start_version == end_version:
+        version = start_version
+    else:
+        raise ValueError('Mixed range ' + first + ' - ' + last)
+    if start > end:
+        raise ValueError('Empty range ' + first + ' - ' + last)
+    if version == 4:
+        return [(4, start, end)]
+    ranges = []
+    mapped_end = V4_MAPPED + V4_MAX
+    if start < V4_MAPPED:
+        ranges.append((6, start, min(end, V4_MAPPED - 1)))
+    if start <= mapped_end and end >= V4_MAPPED:
+        ranges.append((4, max(start, V4_MAPPED) - V4_MAPPED, min(end, mapped_end) - V4_MAPPED))
+    if end > mapped_end:
+        ranges.append((6, max(start, mapped_end + 1), end))
+    return ranges
+
+def compile_database(csv_path, out_dir, ipv6=False):
+    '''
+    Compile a CSV of IP ranges into the memory mappable format
+
+    Args:
+        csv_path: the CSV file to read
+        out_dir: the directory to write the arrays to
+        ipv6: the CSV is an IPv6 database with integer addresses
+
+    Returns:
+        count: the number of ranges compiled
+    '''
+    locations = {}
+    ranges = {4: [], 6: []}
+    with open(csv_path, 'r', newline='') as file:
+        for row in csv.reader(file):
+            if not row or row[0].startswith('#'):
+                continue
+            try:
+                parts = parse_range(row[0], row[1], ipv6)
+            except (ValueError, IndexError):
+                # Header line, or garbage
+                continue
+            location = tuple(field.strip() for field in row[2:8])
+            if location not in locations:
+                locations[location] = len(locations)
+            for version, start, end in parts:
+                ranges[version].append((start, end, locations[location]))
+    for version in ranges:
+        ranges[version].sort()
+
+    os.makedirs(out_dir, exist_ok=True)
+    v4 = ranges[4]
+    numpy.save(os.path.join(out_dir, 'v4_start.npy'), numpy.array([r[0] for r in v4], dtype=numpy.uint32))
+    numpy.save(os.path.join(out_dir, 'v4_end.npy'), numpy.array([r[1] for r in v4], dtype=numpy.uint32))
+    numpy.save(os.path.join(out_dir, 'v4_location.npy'), numpy.array([r[2] for r in v4], dtype=numpy.uint32))
+    v6 = ranges[6]
+    numpy.save(os.path.join(out_dir, 'v6_start_hi.npy'), numpy.array([r[0] >> 64 for r in v6], dtype=numpy.uint64))
+    numpy.save(os.path.join(out_dir, 'v6_start_lo.npy'), numpy.array([r[0] & MASK for r in v6], dtype=numpy.uint64))
+    numpy.save(os.path.join(out_dir, 'v6_end_hi.npy'), numpy.array([r[1] >> 64 for r in v6], dtype=numpy.uint64))
+    numpy.save(os.path.join(out_dir, 'v6_end_lo.npy'), numpy.array([r[1] & MASK for r in v6], dtype=numpy.uint64))
+    numpy.save(os.path.join(out_dir, 'v6_location.npy'), numpy.array([r[2] for r in v6], dtype=numpy.uint32))
+    with open(os.path.join(out_dir, 'locations.json'), 'w') as file:
+        json.dump([list(location) for location in sorted(locations, key=locations.get)], file)
+    return len(v4) + len(v6)
+
+class GeoDatabase:
+    '''
+    A compiled IP range database, searched with binary search over the
+    memory mapped arrays
+    '''
+    def __init__(self, path):
+        self.path = path
+        for name in ARRAYS:
+            setattr(self, name, numpy.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+        with open(os.path.join(path, 'locations.json'), 'r') as file:
+            self.locations = [tuple(location) for location in json.load(file)]
+
+    def _find_v4(self, number):
+        value = numpy.uint32(number)
+        index = int(numpy.searchsorted(self.v4_start, value, side='right')) - 1
+        if index < 0 or self.v4_end[index] < value:
+            return None
+        return int(self.v4_location[index])
+
+    def _find_v6(self, number):
+        hi = numpy.uint64(number >> 64)
+        lo = numpy.uint64(number & MASK)
+        # Ranges whose start shares our high half are a contiguous run,
+        # look for the low half inside it, or take the run before it
+        first = int(numpy.searchsorted(self.v6_start_hi, hi, side='left'))
+        last = int(numpy.searchsorted(self.v6_start_hi, hi, side='right'))
+        index = first + int(numpy.searchsorted(self.v6_start_lo[first:last], lo, side='right')) - 1
+        if index < 0:
+            return None
+        end_hi = self.v6_end_hi[index]
+        if end_hi < hi or (end_hi == hi and self.v6_end_lo[index] < lo):
+            return None
+        return int(self.v6_location[index])
+
+    def lookup(self, ip):
+        '''
+        Find the location of an IP
+
+        Args:
+            ip: the IP to locate
+
+        Returns:
+            data: dictionary with country_name, state, city, postal,
+                latitude and longitude, all 'Not found' if unknown
+        '''
+        try:
+            address = ipaddress.ip_address(ip.strip())
+        except ValueError:
+            address = None
+        index = None
+        if address is not None:
+            if address.version == 6 and address.ipv4_mapped is not None:
+                address = address.ipv4_mapped
+            if address.version == 4:
+                index = self._find_v4(int(address))
+            else:
+                index = self._find_v6(int(address))
+        if index is None:
+            location = ['Not found'] * 6
+        else:
+            location = self.locations[index]
+        return {
+            'country_name': location[0],
+            'state': location[1],
+            'city': location[2],
+            'postal': location[3],
+            'latitude': location[4],
+            'longitude': location[5]
+        }
+
+    def __len__(self):
+        return len(self.v4_start) + len(self.v6_start_hi)
+
+if __name__ == '__main__':
+    ipv6 = '--ipv6' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != '--ipv6']
+    if len(args) != 2:
+        print('Usage: python3 GeoDatabase.py [--ipv6] <ranges.csv> <output directory>')
+        sys.exit(1)
+    print('Compiled ' + str(compile_database(args[0], args[1], ipv6)) + ' ranges')
@@ -0,0 +1,239 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import sqlite3
+import ipaddress
+import threading
+import time
+import requests
+from collections import OrderedDict
+
+GEOLOCATION_TIMEOUT = float(os.environ.get('GEOLOCATION_TIMEOUT', '5'))
+# Results are cached in memory, bounded to CACHE_SIZE entries with LRU
+# eviction, and expire after CACHE_TTL seconds. Set CACHE_BY_PREFIX to
+# share one entry per /24 (IPv4) or /48 (IPv6) network. CACHE_FILE adds
+# an on-disk tier that survives restarts and is shared by all workers.
+CACHE_SIZE = int(os.environ.get('GEOLOCATION_CACHE_SIZE', '10000'))
+CACHE_TTL = float(os.environ.get('GEOLOCATION_CACHE_TTL', str(7 * 24 * 3600)))
+CACHE_BY_PREFIX = os.environ.get('GEOLOCATION_CACHE_BY_PREFIX', '') not in ('', '0')
+CACHE_FILE = os.environ.get('GEOLOCATION_CACHE_FILE')
+# A compiled local range database (see GeoDatabase.py), if set no HTTP
+# request is ever made
+LOCAL_DATABASE = os.environ.get('GEOLOCATION_DATABASE')
+
+class LRUCache:
+    '''
+    A bounded in-memory cache with per entry expiry. The least recently
+    used entry is evicted once the cache is full.
+    '''
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        '''
+        Find a live entry
+
+        Args:
+            key: the key to look for
+
+        Returns:
+            value: the cached value, None if missing or expired
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        '''
+        Add or replace an entry, evicting the oldest ones if needed
+
+        Args:
+            key: the key of the entry
+            value: the value to cache
+        '''
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+class DiskCache:
+    '''
+    A persistent cache in a SQLite file. Every process opens its own
+    connection, so it is safe to use from forked workers.
+    '''
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._con = None
+        self._pid = None
+
+    def _connection(self):
+        if self._pid != os.getpid():
+            self._con = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._con.execute('CREATE TABLE IF NOT EXISTS geolocation '
+                              '(key TEXT PRIMARY KEY, data TEXT NOT NULL, stored REAL NOT NULL)')
+            self._con.commit()
+            self._pid = os.getpid()
+        return self._con
+
+    def get(self, key):
+        '''
+        Find a live entry
+
+        Args:
+            key: the key to look for
+
+        Returns:
+            value: the cached value, None if missing or expired
+        '''
+        with self._lock:
+            row = self._connection().execute('SELECT data, stored FROM geolocation WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] + self.ttl < time.time():
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        '''
+        Add or replace an entry
+
+        Args:
+            key: the key of the entry
+            value: the value to cache, must be JSON serializable
+        '''
+        with self._lock:
+            con = self._connection()
+            con.execute('INSERT OR REPLACE INTO geolocation(key, data, stored) VALUES(?, ?, ?)',
+                        (key, json.dumps(value), time.time()))
+            con.commit()
+
+_memory = LRUCache(CACHE_SIZE, CACHE_TTL)
+_disk = DiskCache(CACHE_FILE, CACHE_TTL) if CACHE_FILE else None
+_local = None
+if LOCAL_DATABASE:
+    from GeoDatabase import GeoDatabase
+    _local = GeoDatabase(LOCAL_DATABASE)
+_lock = threading.Lock()
+_stats = {
+    'memory_hits': 0,
+    'disk_hits': 0,
+    'misses': 0,
+    'local_lookups': 0
+}
+
+def cache_key(ip):
+    '''
+    Get the cache key of an IP, its network if caching by prefix
+
+    Args:
+        ip: the IP to locate
+
+    Returns:
+        key: the cache key
+    '''
+    if not CACHE_BY_PREFIX:
+        return ip
+    try:
+        address = ipaddress.ip_address(ip.strip())
+    except ValueError:
+        return ip
+    prefix = 24 if address.version == 4 else 48
+    return str(ipaddress.ip_network(str(address) + '/' + str(prefix), strict=False))
+
+def lookup(ip):
+    '''
+    Ask the geolocation service for the location of an IP, uncached
+
+    Args:
+        ip: the IP to locate
+
+    Returns:
+        data: dictionary with country_name, state, city, postal,
+            latitude and longitude
+    '''
+    return requests.get('http://geolocation-db.com/json/' + ip + '&position=true', timeout=GEOLOCATION_TIMEOUT).json()
+
+def geolocate(ip):
+    '''
+    Find the location of an IP, from the local database if there is
+    one, otherwise from the caches if possible
+
+    Args:
+        ip: the IP to locate
+
+    Returns:
+        data: dictionary with country_name, state, city, postal,
+            latitude and longitude
+    '''
+    if _local is not None:
+        with _lock:
+            _stats['local_lookups'] += 1
+        return _local.lookup(ip)
+    key = cache_key(ip)
+    data = _memory.get(key)
+    if data is not None:
+        with _lock:
+            _stats['memory_hits'] += 1
+        return data
+    if _disk is not None:
+        try:
+            data = _disk.get(key)
+        except sqlite3.Error as e:
+            print(e)
+        if data is not None:
+            with _lock:
+                _stats['disk_hits'] += 1
+            _memory.put(key, data)
+            return data
+    with _lock:
+        _stats['misses'] += 1
+    data = lookup(ip)
+    _memory.put(key, data)
+    if _disk is not None:
+        try:
+            _disk.put(key, data)
+        except sqlite3.Error as e:
+            print(e)
+    return data
+
+def get_stats():
+    '''
+    Get the geolocation cache statistics of this process
+
+    Returns:
+        stats: dictionary of hits, misses and hit ratio
+    '''
+    with _lock:
+        stats = dict(_stats)
+    total = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+    stats['hit_ratio'] = (stats['memory_hits'] + stats['disk_hits']) / total if total else 0.0
+    stats['entries'] = len(_memory)
+    return stats
@@ -16,6 +16,8 @@
 import dash
 from dash import dcc as dcore
 
+from ContentBundle import read_markdown
+
 def create_publications_layout():
     '''
     Create the layout of the publications tab. This is just a simple
@@ -27,7 +29,6 @@ def create_publications_layout():
         layout: The HTML body of the publications tab
     '''
     # TODO: Add some viz for citations or something
-    with open('assets/content/publications.md', 'r') as file:
-        pub_md = file.read()
+    pub_md = read_markdown('publications')
     layout = dcore.Markdown(pub_md)
     return layout
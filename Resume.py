@@ -14,33 +14,71 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import hmac
+import importlib
 import dash
 from dash import dcc as dcore
 from dash import html as dhtml
-import importlib
-import requests
-import pymysql
-from datetime import datetime
-from flask import request
-from pytz import timezone
+from flask import request, jsonify, Response, abort
+from plotly.io.json import to_json_plotly
 
-from assets.content.links import *
+import assets.content.links as links
 from App import APP
+from Tracking import tracking_enabled, track_visit, get_stats as get_tracking_stats
+from Database import get_stats as get_database_stats
+from Geolocation import get_stats as get_geolocation_stats
 from Background import create_background_layout
 from Work import create_work_layout
 from Publications import create_publications_layout
 from Teaching import create_teaching_layout
 from Skills import create_skills_layout
-from Contact import create_contact_layout
+from Contact import create_contact_layout, draw_calendar
+from CalendarCache import get_version as get_calendar_version
+from Tabs import Tab, register_tab, get_tab, warm_up, get_stats as get_tabs_stats
+import TabCache
+import CalendarCache
+import Export
+import ContentWatcher
+# Imports all subpages, they register callbacks before the first request
+from Router import get_subpage, get_stats as get_router_stats
+
+# Tabs are built on first request and then reused. The background
+# timeline ends today, so it is rebuilt every hour, and the contact
+# tab whenever the calendar changes.
+register_tab('1', create_background_layout, expiry=3600)
+register_tab('2', create_work_layout)
+register_tab('3', create_publications_layout)
+register_tab('4', create_teaching_layout)
+register_tab('5', create_skills_layout)
+register_tab('6', create_contact_layout, version=get_calendar_version)
+# Switch tabs in the browser instead of through tab_picker
+CLIENTSIDE_TABS = os.environ.get('CLIENTSIDE_TABS', '') not in ('', '0')
+# Build them all now if asked to, meant for gunicorn's preload_app
+if os.environ.get('PRELOAD_TABS', '') not in ('', '0'):
+    warm_up()
+
+# The page around the tabs only depends on these files
+SHELL_FILES = ['assets/content/name.md', 'assets/content/links.py']
+
+def get_shell_version():
+    '''
+    Get the version of the page shell content, the modification times of
+    its files
+
+    Returns:
+        version: tuple of modification times
+    '''
+    return tuple(os.stat(path).st_mtime_ns for path in SHELL_FILES)
 
-# These layouts do not need to be updated everytime, they're static
-BACKGROUND = create_background_layout()
-WORK = create_work_layout()
-PUBLICATIONS = create_publications_layout()
-TEACHING = create_teaching_layout()
-SKILLS = create_skills_layout()
-CONTACT = create_contact_layout()
+def build_shell():
+    '''
+    Build the page shell, with the links reloaded as they may have changed
 
+    Returns:
+        layout: The HTML body of the whole page.
+    '''
+    importlib.reload(links)
+    return create_layout()
 
 def create_layout():
     '''
@@ -77,12 +115,12 @@ def create_layout():
     resume_icon = dhtml.Img(src='assets/icons/cv.svg', className='icon')
     email_icon = dhtml.Img(src='assets/icons/em.svg', className='icon')
 
-    github_href = dhtml.A(children=[github_icon], href=github_link)
-    scholar_href = dhtml.A(children=[scholar_icon], href=scholar_link)
-    linkedin_href = dhtml.A(children=[linkedin_icon], href=linkedin_link)
-    stackof_href = dhtml.A(children=[stackof_icon], href=stackof_link)
-    resume_href = dhtml.A(children=[resume_icon], href=resume_link)
-    email_href = dhtml.A(children=[email_icon], href='mailto:'+email_link)
+    github_href = dhtml.A(children=[github_icon], href=links.github_link)
+    scholar_href = dhtml.A(children=[scholar_icon], href=links.scholar_link)
+    linkedin_href = dhtml.A(children=[linkedin_icon], href=links.linkedin_link)
+    stackof_href = dhtml.A(children=[stackof_icon], href=links.stackof_link)
+    resume_href = dhtml.A(children=[resume_icon], href=links.resume_link)
+    email_href = dhtml.A(children=[email_icon], href='mailto:'+links.email_link)
     footer = dhtml.Div(children=[github_href, scholar_href, linkedin_href, stackof_href, resume_href, email_href], className='tab-footer')
     # Footer container makes is stick to the bottom
     footer_container = dhtml.Div(children=[footer], className='tab-footer-container')
@@ -100,8 +138,10 @@ def create_layout():
 
     return layout
 
-@APP.callback(dash.dependencies.Output('body-div', 'children'),
-              [dash.dependencies.Input('tabs', 'value')])
+# The page shell is built once, like the tabs, and rebuilt only when its
+# content files change
+SHELL = Tab('shell', build_shell, version=get_shell_version)
+
 def tab_picker(value):
     '''
     Select the layout to show based on the selected tab
@@ -112,58 +152,78 @@ def tab_picker(value):
     Return:
         layout: the selected layout
     '''
-    layout = None
-    if value == '1':
-        layout = BACKGROUND
-    elif value == '2':
-        layout = WORK
-    elif value == '3':
-        layout = PUBLICATIONS
-    elif value == '4':
-        layout = TEACHING
-    elif value == '5':
-        layout = SKILLS
-    elif value == '6':
-        layout = CONTACT
-    return layout
+    return get_tab(value)
+
+if CLIENTSIDE_TABS:
+    # Tabs are fetched once and switched in the browser, see assets/tabs.js
+    APP.clientside_callback(dash.dependencies.ClientsideFunction(namespace='tabs', function_name='pick'),
+                            dash.dependencies.Output('body-div', 'children'),
+                            [dash.dependencies.Input('tabs', 'value')],
+                            [dash.dependencies.State('tabs', 'children')])
+else:
+    APP.callback(dash.dependencies.Output('body-div', 'children'),
+                 [dash.dependencies.Input('tabs', 'value')])(tab_picker)
 
 server = APP.server
+# Background jobs start before anything else, TabCache may answer a
+# request before the later hooks run
+CalendarCache.install(server)
+# Pick up content edits without a restart
+ContentWatcher.install(server)
+# Serve tab switches from pre-serialized payloads, tab_picker above is
+# only the fallback
+TabCache.install(server)
 APP.layout = dhtml.Div([
     dcore.Location(id='url', refresh=False),
     dhtml.Div(id='main-page')
 ])
 
-def register_visit(key, data):
-    con = pymysql.connect(host=os.environ.get('DATABASE_HOSTNAME'), user=os.environ.get('DATABASE_USERNAME'), password=os.environ.get('DATABASE_PASSWORD'), db=os.environ.get('DATABASE_SCHEMA'))
-    db = con.cursor()
-    try:
-        db.execute('SELECT * FROM visitors WHERE id = %s LIMIT 1', (key,))
-        exists = db.fetchone()
-        if exists is not None:
-            db.execute('UPDATE visitors SET visits = visits + 1 WHERE id = %s', (key,))
-        else:
-            if not data['longitude'] or data['longitude'] == 'Not found':
-                data['longitude'] = 0.0
-            if not data['latitude'] or data['latitude'] == 'Not found':
-                data['latitude'] = 0.0
-            if not data['country_name']:
-                data['country_name'] = 'Not found'
-            if not data['state']:
-                data['state'] = 'Not found'
-            if not data['city']:
-                data['city'] = 'Not found'
-            if not data['postal']:
-                data['postal'] = 'Not found'
-            db.execute('INSERT INTO visitors(id, country, state, city, postal, longitude, latitude) '
-                       'VALUES(%s, %s, %s, %s, %s, %s, %s)', (key, data['country_name'], data['state'], 
-                       data['city'], data['postal'], data['longitude'], data['latitude']))
-        con.commit()
-    except pymysql.Error as e:
-        if hasattr(e, 'message'):
-            print(e.message)
-        else:
-            print(e)
-        con.rollback()
+# /_stats needs this token, as a bearer token or the token argument. If
+# it is not set, /_stats is disabled: behind a reverse proxy every request
+# comes from this machine, so the address can not be trusted.
+STATS_TOKEN = os.environ.get('STATS_TOKEN', '')
+
+def stats_allowed():
+    '''
+    Check whether the current request may read the statistics
+
+    Returns:
+        allowed: True if a token is set and the request has it
+    '''
+    if not STATS_TOKEN:
+        return False
+    header = request.headers.get('Authorization', '')
+    token = header[len('Bearer '):] if header.startswith('Bearer ') else request.args.get('token', '')
+    return hmac.compare_digest(token.encode('utf-8'), STATS_TOKEN.encode('utf-8'))
+
+# Stream the visits out as CSV or Parquet, with the same token
+Export.install(server, stats_allowed)
+
+@server.route('/_stats')
+def stats():
+    '''
+    Report the runtime statistics of this worker, as JSON
+
+    Returns:
+        response: the statistics of every subsystem
+    '''
+    if not stats_allowed():
+        abort(403)
+    return jsonify(tracking=get_tracking_stats(), database=get_database_stats(), geolocation=get_geolocation_stats(), tabs=get_tabs_stats(), tab_payloads=TabCache.get_stats(), router=get_router_stats(), content=ContentWatcher.get_stats())
+
+@server.route('/_calendar.json')
+def calendar():
+    '''
+    Send the calendar figure, as JSON. Used by the static export of the
+    site, which may be served from another origin.
+
+    Returns:
+        response: the calendar figure
+    '''
+    response = Response(to_json_plotly(draw_calendar()), mimetype='application/json')
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
 
 @APP.callback(dash.dependencies.Output('main-page', 'children'),
               [dash.dependencies.Input('url', 'pathname')])
@@ -171,25 +231,17 @@ def display_page(pathname):
     if pathname == None:
         return None
     if pathname == '/':
-        if os.environ.get('DATABASE_USERNAME') and os.environ.get('DATABASE_PASSWORD') and os.environ.get('DATABASE_HOSTNAME') and os.environ.get('DATABASE_SCHEMA'):
+        if tracking_enabled():
             # https://stackoverflow.com/a/49760261/2328163
             if request.environ.get('HTTP_X_FORWARDED_FOR') is None:
                 ip = request.environ['REMOTE_ADDR']
             else:
                 ip = request.environ['HTTP_X_FORWARDED_FOR']
-            now = datetime.now()
-            mins = now.minute - (now.minute % 5)        # Round to 5 mins
-            now = datetime(now.year, now.month, now.day, now.hour, mins)
-            now = timezone('US/Eastern').localize(now)
-            time = now.strftime('%Y/%m/%d %I:%M%p')
-            data = requests.get('http://geolocation-db.com/json/' + ip + '&position=true').json()
-            key = ip + '-' + time
-            register_visit(key, data)
-        return create_layout()
-    try:
-        sub = importlib.import_module('subpages.'+pathname.strip('/'))
-    except Exception as e:
-        print(e)
+            # Geolocation and database are handled in the background
+            track_visit(ip)
+        return SHELL.get()[0]
+    sub = get_subpage(pathname)
+    if sub is None:
         return dhtml.Div([
             dhtml.H3('No such page')
         ])
@@ -0,0 +1,132 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+from datetime import date, timedelta
+
+from Database import connection
+from Threads import start_thread
+
+# The visits table is rolled up into visits_daily, visits per (day,
+# country, state, city). Distinct visitors are counted by Sketches.py.
+# Only the days since the day before the last rolled up one are
+# recomputed, so every run costs the new rows only, and visits flushed
+# late (see Tracking.py) after midnight still reach their day. Raw
+# visits older than RETENTION_DAYS (0 keeps them forever) are moved to
+# visits_archive once rolled up. Any worker may run the job, a MySQL
+# named lock makes sure only one does at a time.
+INTERVAL = float(os.environ.get('ROLLUP_INTERVAL', '300'))
+RETENTION_DAYS = int(os.environ.get('ROLLUP_RETENTION_DAYS', '0'))
+ARCHIVE_BATCH = 5000
+
+def compact():
+    '''
+    Recompute the rollup of every day since the day before the last
+    rolled up one, both may have been partial
+
+    Returns:
+        since: the first day recomputed, None if there was nothing
+    '''
+    with connection() as con:
+        db = con.cursor()
+        db.execute('SELECT MAX(day) - INTERVAL 1 DAY FROM visits_daily')
+        since = db.fetchone()[0]
+        if since is None:
+            db.execute('SELECT DATE(MIN(bucket)) FROM visits')
+            since = db.fetchone()[0]
+            if since is None:
+                return None
+        db.execute('DELETE FROM visits_daily WHERE day >= %s', (since,))
+        db.execute('INSERT INTO visits_daily(day, country_id, state, city, longitude, latitude, visits) '
+                   'SELECT DATE(bucket) AS day, country_id, state, city, MAX(longitude), MAX(latitude), '
+                   'SUM(visits) FROM visits WHERE bucket >= %s '
+                   'GROUP BY day, country_id, state, city', (since,))
+        con.commit()
+    return since
+
+def archive():
+    '''
+    Move raw visits older than the retention window to visits_archive,
+    only days that are already rolled up
+
+    Returns:
+        count: the number of visits moved
+    '''
+    if RETENTION_DAYS <= 0:
+        return 0
+    count = 0
+    with connection() as con:
+        db = con.cursor()
+        db.execute('SELECT MAX(day) FROM visits_daily')
+        rolled = db.fetchone()[0]
+        if rolled is None:
+            return 0
+        # compact() recomputes the day before the last rolled up one from
+        # the raw visits, keep it
+        cutoff = min(date.today() - timedelta(days=RETENTION_DAYS), rolled - timedelta(days=1))
+        while True:
+            db.execute('SELECT bucket FROM visits WHERE bucket < %s ORDER BY bucket LIMIT %s', (cutoff, ARCHIVE_BATCH))
+            buckets = db.fetchall()
+            if not buckets:
+                break
+            last = buckets[-1][0]
+            db.execute('INSERT INTO visits_archive SELECT * FROM visits WHERE bucket < %s AND bucket <= %s '
+                       'ON DUPLICATE KEY UPDATE visits = visits_archive.visits + VALUES(visits)', (cutoff, last))
+            db.execute('DELETE FROM visits WHERE bucket < %s AND bucket <= %s', (cutoff, last))
+            con.commit()
+            count += db.rowcount
+    return count
+
+def run():
+    '''
+    Compact and archive, unless another worker is already doing it
+
+    Returns:
+        ran: True if this call did the job
+    '''
+    with connection() as con:
+        db = con.cursor()
+        db.execute("SELECT GET_LOCK('resume_rollup', 0)")
+        if not db.fetchone()[0]:
+            return False
+        try:
+            compact()
+            archive()
+        finally:
+            db.execute("SELECT RELEASE_LOCK('resume_rollup')")
+            db.fetchall()
+    return True
+
+def _runner():
+    '''
+    Background loop, runs the job every INTERVAL seconds. Errors are
+    printed and retried next time.
+    '''
+    while True:
+        time.sleep(INTERVAL)
+        try:
+            run()
+        except Exception as e:
+            print(e)
+
+def start():
+    '''
+    Start the background job of this process, if not running yet
+    '''
+    start_thread('rollup', _runner)
+
+if __name__ == '__main__':
+    run()
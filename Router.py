@@ -0,0 +1,108 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import importlib
+import pkgutil
+import threading
+import time
+from collections import OrderedDict
+
+import subpages
+
+# The subpages package is listed once, every subpage is imported then
+# (they register callbacks, that must happen before the first request),
+# and paths are resolved with a dictionary lookup. Unknown paths, mostly
+# scanners, never reach the import system. The last NEGATIVE_CACHE_SIZE
+# of them are remembered with their hit counts, for the statistics.
+NEGATIVE_CACHE_SIZE = int(os.environ.get('ROUTER_NEGATIVE_CACHE_SIZE', '1000'))
+
+_lock = threading.Lock()
+_modules = {}
+_broken = {}
+_misses = OrderedDict()
+_stats = {
+    'hit_count': 0,
+    'miss_count': 0,
+    'hit_latency_total': 0.0,
+    'hit_latency_max': 0.0,
+    'miss_latency_total': 0.0,
+    'miss_latency_max': 0.0
+}
+
+def discover():
+    '''
+    Find and import every subpage. A subpage failing to import is kept
+    as broken, and reported as not found.
+    '''
+    for module in pkgutil.iter_modules(subpages.__path__):
+        if module.ispkg or module.name.startswith('_'):
+            continue
+        try:
+            _modules[module.name] = importlib.import_module('subpages.' + module.name)
+        except Exception as e:
+            print(e)
+            _broken[module.name] = str(e)
+
+def _record(kind, start):
+    latency = time.perf_counter() - start
+    _stats[kind + '_count'] += 1
+    _stats[kind + '_latency_total'] += latency
+    _stats[kind + '_latency_max'] = max(_stats[kind + '_latency_max'], latency)
+
+def get_subpage(pathname):
+    '''
+    Find the subpage of a path
+
+    Args:
+        pathname: the path of the page, e.g. /Visitors
+
+    Returns:
+        module: the subpage module, None if there is no such page
+    '''
+    start = time.perf_counter()
+    name = pathname.strip('/')
+    module = _modules.get(name)
+    with _lock:
+        if module is not None:
+            _record('hit', start)
+            return module
+        _misses[name] = _misses.pop(name, 0) + 1
+        while len(_misses) > NEGATIVE_CACHE_SIZE:
+            _misses.popitem(last=False)
+        _record('miss', start)
+    return None
+
+def get_stats():
+    '''
+    Get the router statistics of this process
+
+    Returns:
+        stats: dictionary of hit and miss counts and latencies, the
+            known and broken subpages, and the most missed paths
+    '''
+    with _lock:
+        stats = dict(_stats)
+        misses = sorted(_misses.items(), key=lambda miss: miss[1], reverse=True)[:20]
+    for kind in ('hit', 'miss'):
+        count = stats[kind + '_count']
+        stats[kind + '_latency_avg'] = stats[kind + '_latency_total'] / count if count else 0.0
+        del stats[kind + '_latency_total']
+    stats['subpages'] = sorted(_modules)
+    stats['broken'] = _broken
+    stats['top_misses'] = dict(misses)
+    return stats
+
+discover()
@@ -14,53 +14,89 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import dash
+import importlib
 from dash import dcc as dcore
 from dash import html as dhtml
 import plotly.graph_objs as go
 
 from App import APP
-from assets.content.skills import *
+from ContentBundle import get_bundle, skill_id
 
-last_name = None
-last_value = None
+# Levels of the sunburst sent at once, deeper ones are loaded when
+# the user clicks into a category
+SKILL_DEPTH = 2
 
-def dict_to_lists(skills_dict, labels_vec, parents_vec, parent=''):
+def compile_skill_tree(skills_dict, tree, parent='', depth=0):
     '''
-    Convert the dictionary to lists of names and parents, recursively
+    Convert the dictionary to a flat tree, recursively. Every node gets
+    a unique id (its full path, see ContentBundle.skill_id), its parent id,
+    its depth, its children ids, and its value (the number of skills
+    under it).
 
     Args:
         skills_dict: The skills dictionary to convert
-        labels_vec: The vector of names, this will be appended to
-        parents_vec: The vector of parents, this will be appended to
-        parent: The parent of the current level, empty by default
+        tree: The map of id to node, this will be added to
+        parent: The id of the parent of the current level, empty by default
+        depth: The depth of the current level
 
     Returns:
+        value: The number of skills at this level and below
     '''
+    total = 0
     for name, value in skills_dict.items():
-        labels_vec.append(name)
-        parents_vec.append(parent)
+        node_id = skill_id(parent, name)
+        node = {'label': name, 'parent': parent, 'depth': depth, 'children': [], 'value': 1}
+        tree[node_id] = node
+        if parent:
+            tree[parent]['children'].append(node_id)
         if isinstance(value, dict):
-            dict_to_lists(value, labels_vec, parents_vec, name)
+            node['value'] = compile_skill_tree(value, tree, node_id, depth + 1)
+        total += node['value']
+    return total
 
-def draw_skills():
+SKILL_TREE = {}
+_figures = {}
+
+def draw_skills(root='', depth=SKILL_DEPTH):
     '''
-    Draw the sunburst figure showing the entire skill
-    tree
+    Draw the sunburst figure showing the skill tree, SKILL_DEPTH levels
+    deep. Figures are memoized per root.
 
     Args:
+        root: The id of the category in the center, empty for the
+            whole tree
+        depth: The number of levels sent, None to send the whole tree,
+            still showing SKILL_DEPTH levels, so it can be browsed
+            without any callback
 
     Returns:
-        figure: The plotly figure showing all skills
+        figure: The plotly figure showing the skills
     '''
-    # Create the relationship vectors
-    labels = []
-    parents = []
-    dict_to_lists(skills, labels, parents)
-    
+    if (root, depth) in _figures:
+        return _figures[(root, depth)]
+
+    # Collect the visible nodes
+    if root:
+        nodes = [root]
+        base = SKILL_TREE[root]['depth']
+        frontier = SKILL_TREE[root]['children']
+    else:
+        nodes = []
+        base = -1
+        frontier = [node_id for node_id, node in SKILL_TREE.items() if node['depth'] == 0]
+    while frontier:
+        nodes.extend(frontier)
+        frontier = [child for node_id in frontier for child in SKILL_TREE[node_id]['children']
+                    if depth is None or SKILL_TREE[child]['depth'] - base <= depth]
+
     # Plot
     data = [go.Sunburst(
-        labels=labels,
-        parents=parents,
+        ids=nodes,
+        labels=[SKILL_TREE[node_id]['label'] for node_id in nodes],
+        parents=[SKILL_TREE[node_id]['parent'] if node_id != root else '' for node_id in nodes],
+        values=[SKILL_TREE[node_id]['value'] for node_id in nodes],
+        branchvalues='total',
+        maxdepth=SKILL_DEPTH + 1 if depth is None else -1,
         insidetextorientation='radial'
     )]
 
@@ -85,101 +121,115 @@ def draw_skills():
 
     # Return
     figure = go.Figure(data=data, layout=layout)
+    _figures[(root, depth)] = figure
     return figure
 
 @APP.callback(
-    dash.dependencies.Output('bar', 'figure'),
-    [dash.dependencies.Input('skills', 'hoverData')])
-def draw_skill_level(hoverData):
+    [dash.dependencies.Output('skills', 'figure'),
+     dash.dependencies.Output('skills-root', 'data')],
+    [dash.dependencies.Input('skills', 'clickData')],
+    [dash.dependencies.State('skills-root', 'data')])
+def drill_skills(clickData, root):
     '''
-    Draw the bar showing the excellence of this skill
+    Load the levels under a clicked category, or go back up when the
+    center is clicked
 
     Args:
-        hoverData: contains the full path of the skill, with levels
-            separated by /, and its label
+        clickData: contains the id of the clicked node
+        root: the id of the category currently in the center
 
     Returns:
-        figure: The plotly bar plot
+        figure: The plotly figure rooted at the new category
+        root: the id of the new category in the center
     '''
-    global last_name
-    global last_value
-
-    if hoverData is None:
-        # Pick the first ever skill
-        current_dict = skills
-        keys = list(current_dict.keys())
-        while isinstance(current_dict[keys[0]], dict):
-            current_dict = current_dict[keys[0]]
-            keys = list(current_dict.keys())
-        name = keys[0]
-        value = current_dict[keys[0]]
-    else:
-        path = list(filter(None, hoverData['points'][0]['currentPath'].split('/')))
-        # Follow the path till we get the value
-        current_dict = skills
-        for i in range(len(path)):
-            current_dict = current_dict[path[i]]
-        name = hoverData['points'][0]['label']
-        value = current_dict[hoverData['points'][0]['label']]
-
-    # If no value selected, keep last
-    if isinstance(value, dict):
-        name = last_name
-        value = last_value
+    if clickData is None:
+        return dash.no_update, dash.no_update
+    node_id = clickData['points'][0].get('id')
+    if node_id not in SKILL_TREE:
+        return dash.no_update, dash.no_update
+    if node_id == root:
+        new_root = SKILL_TREE[root]['parent']
+    elif SKILL_TREE[node_id]['children']:
+        new_root = node_id
     else:
-        last_name = name
-        last_value = value
+        # A skill, nothing under it
+        return dash.no_update, dash.no_update
+    return draw_skills(new_root), new_root
 
-    # color
+def skill_color(value):
+    '''
+    Pick the color of a skill level
+
+    Args:
+        value: the skill level, 0 to 100
+
+    Returns:
+        color: the bar color
+    '''
     if value <= 20:
-        color = '#FF4E11'
+        return '#FF4E11'
     elif value <= 40:
-        color = '#FF8E15'
+        return '#FF8E15'
     elif value <= 60:
-        color = '#FAB733'
+        return '#FAB733'
     elif value <= 80:
-        color = '#ACB334'
-    elif value <= 100:
-        color = '#69B34C'
-
-    # data
-    data = [go.Bar(
-        x = [0],
-        y = [value],
-        marker_color = [color],
-        hoverinfo = 'text',
-        hovertext = [str(value) + '%']
-    )]
+        return '#ACB334'
+    return '#69B34C'
 
-    # layout
-    layout = dict(
-        title=dict(
-            text='<b>' + name + '</b>',
-            y=0.95,
-            x=0.5,
-            xanchor='center',
-            yanchor='top',
-            font=dict(
-                family='Heebo',
-                size=24,
-                color='black'
-            )
-        ),
-        xaxis=dict(
-            visible=False
-        ),
-        yaxis=dict(
-            range=[0,101],
-            tickvals=[0,20,40,60,80,100],
-            ticktext=['None','Just Started','Know Some','Good','Excellent','Master']
-        ),
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)'
-    )
+def build_skill_index(skills_dict, index, path=''):
+    '''
+    Flatten the skills dictionary to a map from the id of every skill,
+    the same as in the skill tree, to its label, value and color,
+    recursively
 
-    # Return
-    figure = go.Figure(data=data, layout=layout)
-    return figure
+    Args:
+        skills_dict: The skills dictionary to convert
+        index: The flat map, this will be added to
+        path: The path of the current level, empty by default
+
+    Returns:
+    '''
+    for name, value in skills_dict.items():
+        if isinstance(value, dict):
+            build_skill_index(value, index, skill_id(path, name))
+        else:
+            index[skill_id(path, name)] = {'label': name, 'value': value, 'color': skill_color(value)}
+
+# The bar is drawn in the browser from it (assets/skills.js)
+SKILL_INDEX = {}
+
+def load_skills():
+    '''
+    Build the skill tree and index, or take them from the content bundle
+    with the default figure. Called once, and again whenever the skills
+    content changes.
+    '''
+    global SKILL_TREE
+    global SKILL_INDEX
+    global _figures
+    bundle = get_bundle()
+    figures = {}
+    if bundle is not None:
+        tables = bundle.get_json('tables/skills')
+        tree = tables['tree']
+        index = tables['index']
+        figures[('', SKILL_DEPTH)] = bundle.get_json('figures/skills')
+    else:
+        skills = importlib.import_module('assets.content.skills').skills
+        tree = {}
+        compile_skill_tree(skills, tree)
+        index = {}
+        build_skill_index(skills, index)
+    SKILL_TREE, SKILL_INDEX, _figures = tree, index, figures
+
+load_skills()
+
+# Hovering a skill redraws the bar client side, no server round trip
+APP.clientside_callback(
+    dash.dependencies.ClientsideFunction(namespace='skills', function_name='draw_skill_level'),
+    dash.dependencies.Output('bar', 'figure'),
+    [dash.dependencies.Input('skills', 'hoverData')],
+    [dash.dependencies.State('skill-index', 'data')])
 
 def create_skills_layout():
     '''
@@ -199,6 +249,10 @@ def create_skills_layout():
     # Bar
     bar = dcore.Graph(id='bar', className='one-sixth-column whole-row', style={'float': 'right', 'align': 'right'})
 
+    # Skill levels, for the bar, and the category in the center
+    index = dcore.Store(id='skill-index', data=SKILL_INDEX)
+    root = dcore.Store(id='skills-root', data='')
+
     # Layout
-    layout = dhtml.Div(children=[sunburst, bar], className='whole-row')
+    layout = dhtml.Div(children=[sunburst, bar, index, root], className='whole-row')
     return layout
@@ -0,0 +1,340 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import html
+import hashlib
+import argparse
+from plotly.io.json import to_json_plotly
+from plotly.offline import get_plotlyjs
+from markdown_it import MarkdownIt
+
+from Skills import draw_skills
+
+# Renders the resume to plain files, servable by any static file server
+# or CDN: one index.html with every tab, figures as separate JSON files
+# loaded when their tab is first shown, and every asset renamed after
+# its content hash so it can be cached forever. Markdown is rendered
+# with markdown-it-py.
+ASSETS = 'assets'
+SKIPPED_ASSETS = ['content', '__pycache__']
+SITE_SCRIPT = 'static/site.js'
+# Graphs whose figure differs in the export, by component id. The
+# skills sunburst has the whole tree, so it can be browsed without its
+# drill down callback.
+FIGURES = {
+    'skills': lambda: draw_skills(depth=None)
+}
+# Graphs that may be fetched fresh from the app, by component id
+LIVE_FIGURES = {
+    'calendar': '/_calendar.json'
+}
+VOID_TAGS = ['area', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr']
+SKIPPED_PROPS = ['children', 'style', 'className', 'n_clicks', 'n_clicks_timestamp', 'disable_n_clicks',
+                 'loading_state', 'key', 'setProps']
+UNITLESS_STYLES = ['opacity', 'zIndex', 'fontWeight', 'lineHeight', 'flex', 'flexGrow', 'flexShrink', 'order']
+
+def fingerprint(data):
+    '''
+    Get the short content hash put in the name of exported files
+
+    Args:
+        data: the file content
+
+    Returns:
+        digest: the first 10 hex digits of its sha256
+    '''
+    return hashlib.sha256(data).hexdigest()[:10]
+
+def write_file(out_dir, path, data):
+    '''
+    Write an exported file, named after its content hash
+
+    Args:
+        out_dir: the export directory
+        path: the path of the file inside the export, the hash is added
+            before its extension
+        data: the file content
+
+    Returns:
+        path: the path of the written file inside the export
+    '''
+    base, extension = os.path.splitext(path)
+    path = base + '.' + fingerprint(data) + extension
+    os.makedirs(os.path.dirname(os.path.join(out_dir, path)), exist_ok=True)
+    with open(os.path.join(out_dir, path), 'wb') as file:
+        file.write(data)
+    return path
+
+def copy_assets(out_dir):
+    '''
+    Copy the assets to the export with fingerprinted names. Style sheets
+    are copied last, with the urls inside them fingerprinted too.
+
+    Args:
+        out_dir: the export directory
+
+    Returns:
+        manifest: dictionary of original path to exported path
+    '''
+    manifest = {}
+    sheets = []
+    for directory, subdirectories, files in os.walk(ASSETS):
+        subdirectories[:] = sorted(name for name in subdirectories if name not in SKIPPED_ASSETS)
+        for name in sorted(files):
+            path = os.path.join(directory, name).replace(os.sep, '/')
+            if name.endswith('.py'):
+                continue
+            if name.endswith('.css'):
+                sheets.append(path)
+                continue
+            with open(path, 'rb') as file:
+                manifest[path] = write_file(out_dir, path, file.read())
+
+    def fingerprint_url(match, directory):
+        url = match.group(2)
+        if re.match(r'^([a-z]+:|/|#)', url):
+            return match.group(0)
+        target = os.path.normpath(os.path.join(directory, url.split('?')[0].split('#')[0])).replace(os.sep, '/')
+        if target not in manifest:
+            return match.group(0)
+        return 'url(' + match.group(1) + os.path.relpath(manifest[target], directory).replace(os.sep, '/') + match.group(1) + ')'
+
+    for path in sheets:
+        with open(path, 'r') as file:
+            sheet = file.read()
+        directory = os.path.dirname(path)
+        sheet = re.sub(r'url\(([\'"]?)([^\'")]+)\1\)', lambda match: fingerprint_url(match, directory), sheet)
+        manifest[path] = write_file(out_dir, path, sheet.encode('utf-8'))
+    return manifest
+
+def style_to_css(style):
+    '''
+    Convert a React style dictionary to CSS
+
+    Args:
+        style: dictionary of camel case properties to values
+
+    Returns:
+        css: the inline CSS
+    '''
+    declarations = []
+    for key, value in style.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and key not in UNITLESS_STYLES:
+            value = str(value) + 'px'
+        declarations.append(re.sub(r'([A-Z])', r'-\1', key).lower() + ': ' + str(value))
+    return '; '.join(declarations)
+
+class StaticRenderer:
+    '''
+    Renders Dash component trees to HTML. HTML components become their
+    tags, Markdown is rendered, Graphs become placeholders whose figure
+    is written to a JSON file. Anything only meaningful with callbacks
+    (stores, intervals, tables) is left out.
+    '''
+    def __init__(self, out_dir, api=None):
+        self.out_dir = out_dir
+        self.api = api.rstrip('/') if api else None
+        self.fill = {}
+        self.figures = 0
+        self.markdown = MarkdownIt('commonmark', {'html': False})
+        self.markdown_html = MarkdownIt('commonmark', {'html': True})
+
+    def render(self, component):
+        '''
+        Render a component, or list of components, and their children
+
+        Args:
+            component: the component, a list of them, or text
+
+        Returns:
+            html: the rendered HTML
+        '''
+        if component is None:
+            return ''
+        if isinstance(component, (list, tuple)):
+            return ''.join(self.render(child) for child in component)
+        if isinstance(component, (str, int, float)):
+            return html.escape(str(component))
+        namespace = component._namespace
+        props = {name: getattr(component, name) for name in component._prop_names
+                 if getattr(component, name, None) is not None}
+        if props.get('id') in self.fill:
+            props['children'] = None
+            return self.tag('div', props, self.fill[props['id']])
+        if namespace == 'dash_html_components':
+            return self.tag(component._type.lower(), props, self.render(props.get('children')))
+        handler = getattr(self, 'render_' + component._type.lower(), None)
+        if namespace == 'dash_core_components' and handler is not None:
+            return handler(props)
+        return ''
+
+    def tag(self, name, props, inner=''):
+        '''
+        Create an HTML element from component properties
+
+        Args:
+            name: the tag name
+            props: the component properties
+            inner: the rendered children
+
+        Returns:
+            html: the element
+        '''
+        attributes = []
+        if props.get('className'):
+            attributes.append(('class', props['className']))
+        if props.get('style'):
+            attributes.append(('style', style_to_css(props['style'])))
+        for key, value in props.items():
+            if key in SKIPPED_PROPS or not isinstance(value, (str, int, float)):
+                continue
+            if value is True:
+                attributes.append((key.lower(), None))
+            elif value is not False:
+                attributes.append((key.lower(), str(value)))
+        opening = '<' + name + ''.join(' ' + key if value is None else ' ' + key + '="' + html.escape(value) + '"'
+                                       for key, value in attributes) + '>'
+        if name in VOID_TAGS:
+            return opening
+        return opening + inner + '</' + name + '>'
+
+    def render_markdown(self, props):
+        children = props.get('children') or ''
+        if isinstance(children, (list, tuple)):
+            children = '\n'.join(children)
+        if props.get('dangerously_allow_html'):
+            inner = self.markdown_html.render(children)
+        else:
+            inner = self.markdown.render(children)
+        return self.tag('div', {'className': props.get('className'), 'style': props.get('style'),
+                                'id': props.get('id')}, inner)
+
+    def render_graph(self, props):
+        figure = props.get('figure')
+        if props.get('id') in FIGURES:
+            figure = FIGURES[props['id']]()
+        attributes = {'className': ((props.get('className') or '') + ' static-graph').strip(),
+                      'style': props.get('style'), 'id': props.get('id')}
+        if figure is None:
+            # Only ever drawn by a callback (the skill level bar), which
+            # the export has none of, so it would stay empty
+            return ''
+        data = to_json_plotly(figure).encode('utf-8')
+        attributes['data-figure'] = write_file(self.out_dir, 'figures/' + (props.get('id') or 'figure') + '.json', data)
+        if self.api is not None and props.get('id') in LIVE_FIGURES:
+            attributes['data-live'] = self.api + LIVE_FIGURES[props['id']]
+        self.figures += 1
+        return self.tag('div', attributes)
+
+    def render_tabs(self, props):
+        tabs = []
+        for tab in props.get('children') or []:
+            selected = tab.value == props.get('value')
+            classes = {'data-class': tab.className or '', 'data-selected-class': tab.selected_className or ''}
+            tabs.append(self.tag('div', dict(classes, **{'data-tab': tab.value,
+                                                         'className': classes['data-selected-class' if selected else 'data-class']}),
+                                 '<span>' + html.escape(tab.label or '') + '</span>'))
+        container = self.tag('div', {'className': props.get('className')}, ''.join(tabs))
+        return self.tag('div', {'className': props.get('parent_className'), 'id': props.get('id')}, container)
+
+def find_component(component, type_name):
+    '''
+    Find the first component of a type in a tree
+
+    Args:
+        component: the root of the tree
+        type_name: the component type, e.g. Tabs
+
+    Returns:
+        component: the component found, None if there is none
+    '''
+    if isinstance(component, (list, tuple)):
+        for child in component:
+            found = find_component(child, type_name)
+            if found is not None:
+                return found
+        return None
+    if not hasattr(component, '_type'):
+        return None
+    if component._type == type_name:
+        return component
+    return find_component(getattr(component, 'children', None), type_name)
+
+def build(out_dir, api=None):
+    '''
+    Export the whole resume
+
+    Args:
+        out_dir: the export directory
+        api: the URL of the running app, its dynamic pieces are fetched
+            from it when available, None to only use the exported ones
+
+    Returns:
+        renderer: the StaticRenderer used, for its statistics
+    '''
+    # The app registers the tabs, in the same way it serves them
+    import Resume
+    from App import APP
+    from Tabs import get_tab
+
+    manifest = copy_assets(out_dir)
+    with open(SITE_SCRIPT, 'rb') as file:
+        site_script = write_file(out_dir, 'assets/site.js', file.read())
+    plotly_script = write_file(out_dir, 'assets/plotly.min.js', get_plotlyjs().encode('utf-8'))
+
+    renderer = StaticRenderer(out_dir, api)
+    shell = Resume.create_layout()
+    tabs = find_component(shell, 'Tabs')
+    sections = []
+    for tab in tabs.children:
+        hidden = '' if tab.value == tabs.value else ' hidden'
+        sections.append('<section data-section="' + html.escape(tab.value) + '"' + hidden + '>' +
+                        renderer.render(get_tab(tab.value)) + '</section>')
+    renderer.fill['body-div'] = ''.join(sections)
+    body = renderer.render(shell)
+
+    head = ['<meta charset="utf-8">', '<meta name="viewport" content="width=device-width, initial-scale=1">',
+            '<title>' + html.escape(APP.title) + '</title>']
+    scripts = [plotly_script]
+    for path in sorted(manifest):
+        if path == 'assets/favicon.ico':
+            head.append('<link rel="icon" href="' + path + '">')
+        elif path.endswith('.css') and os.path.dirname(path) == ASSETS:
+            head.append('<link rel="stylesheet" href="' + path + '">')
+        elif path.endswith('.js') and os.path.dirname(path) == ASSETS:
+            with open(path, 'r') as file:
+                # Clientside callbacks are of no use without Dash
+                if 'dash_clientside' not in file.read():
+                    scripts.append(manifest[path])
+    scripts.append(site_script)
+    page = ('<!DOCTYPE html>\n<html>\n<head>\n' + '\n'.join(head) + '\n</head>\n<body>\n' + body + '\n' +
+            '\n'.join('<script src="' + script + '"></script>' for script in scripts) + '\n</body>\n</html>\n')
+    # Point every asset reference, markdown images included, to its
+    # fingerprinted copy
+    page = re.sub(r'((?:src|href)=")/?(assets/[^"]+)"',
+                  lambda match: match.group(1) + manifest.get(match.group(2), match.group(2)) + '"', page)
+    with open(os.path.join(out_dir, 'index.html'), 'w') as file:
+        file.write(page)
+    return renderer
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the resume as a static site')
+    parser.add_argument('out_dir', help='the directory to write the site to')
+    parser.add_argument('--api', help='URL of the running app, to fetch the live calendar from')
+    args = parser.parse_args()
+    renderer = build(args.out_dir, args.api)
+    print('Exported the site to ' + args.out_dir + ' with ' + str(renderer.figures) + ' figures')
@@ -0,0 +1,263 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import hashlib
+import threading
+import time
+import flask
+from werkzeug.wsgi import wrap_file
+from plotly.io.json import to_json_plotly
+
+from Tabs import get_tab_generation
+from ContentBundle import get_bundle
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# The tabs rarely change, yet Dash would encode the same component tree
+# (large figures included) to JSON on every tab switch. Instead, every
+# tab is serialized once per build into a ready to send callback
+# response, with compressed copies, and the tab_picker callback request
+# is answered directly from these bytes.
+OUTPUT = 'body-div.children'
+
+class Payload:
+    '''
+    The serialized callback response of one tab build
+    '''
+    def __init__(self, generation, body, response, compressed, serialize_time=0.0, compress_time=0.0):
+        self.generation = generation
+        self.body = body
+        self.response = response
+        self.etag = hashlib.sha256(body).hexdigest()
+        self.gzip, self.brotli, self.body_gzip, self.body_brotli = compressed
+        self.serialize_time = serialize_time
+        self.compress_time = compress_time
+        self.hits = 0
+        # The Bundle and section prefix of a bundled payload
+        self.bundle = None
+        self.prefix = None
+
+    @classmethod
+    def build(cls, layout, generation):
+        '''
+        Serialize and compress a tab layout
+
+        Args:
+            layout: the tab layout
+            generation: the build count of the layout
+
+        Returns:
+            payload: the new Payload
+        '''
+        start = time.perf_counter()
+        body = to_json_plotly(layout).encode('utf-8')
+        response = b'{"multi":true,"response":{"body-div":{"children":' + body + b'}}}'
+        serialize_time = time.perf_counter() - start
+        start = time.perf_counter()
+        compressed = (gzip.compress(response, 6), brotli.compress(response) if brotli is not None else None,
+                      gzip.compress(body, 6), brotli.compress(body) if brotli is not None else None)
+        return cls(generation, body, response, compressed, serialize_time, time.perf_counter() - start)
+
+    @classmethod
+    def from_bundle(cls, bundle, value):
+        '''
+        Get the payload of a tab compiled into the content bundle. The
+        sections stay views of the mapping, they are sent as files.
+
+        Args:
+            bundle: the content Bundle
+            value: the value of the tab
+
+        Returns:
+            payload: the Payload, None if the tab is not in the bundle
+        '''
+        prefix = 'tabs/' + value + '/'
+        body = bundle.get(prefix + 'body')
+        if body is None:
+            return None
+        compressed = (bundle.get(prefix + 'response.gz'), bundle.get(prefix + 'response.br'),
+                      bundle.get(prefix + 'body.gz'), bundle.get(prefix + 'body.br'))
+        if brotli is None:
+            compressed = (compressed[0], None, compressed[2], None)
+        payload = cls('bundle', body, bundle.get(prefix + 'response'), compressed)
+        payload.bundle = bundle
+        payload.prefix = prefix
+        return payload
+
+_lock = threading.Lock()
+_payloads = {}
+
+def get_payload(value):
+    '''
+    Get the serialized payload of a tab, serializing it if the tab was
+    (re)built since
+
+    Args:
+        value: the value of the tab
+
+    Returns:
+        payload: the Payload, None for an unknown tab
+    '''
+    payload = _payloads.get(value)
+    if payload is not None and payload.generation == 'bundle':
+        return payload
+    bundle = get_bundle()
+    if payload is None and bundle is not None:
+        # Static tabs are never built, they are sent from the bundle
+        with _lock:
+            payload = Payload.from_bundle(bundle, value)
+            if payload is not None:
+                _payloads[value] = payload
+                return payload
+    layout, generation = get_tab_generation(value)
+    if layout is None:
+        return None
+    if payload is None or payload.generation != generation:
+        with _lock:
+            payload = _payloads.get(value)
+            if payload is None or payload.generation != generation:
+                payload = Payload.build(layout, generation)
+                _payloads[value] = payload
+    return payload
+
+def forget_bundle(value):
+    '''
+    Stop sending a tab from the content bundle, once its content changed
+    and the bundle was disabled. The tab is serialized from its layout
+    from then on.
+
+    Args:
+        value: the value of the tab
+    '''
+    with _lock:
+        payload = _payloads.get(value)
+        if payload is not None and payload.generation == 'bundle':
+            del _payloads[value]
+
+def send_payload(payload, bare=False):
+    '''
+    Create the HTTP response for a payload, compressed if the client
+    accepts it
+
+    Args:
+        payload: the Payload to send
+        bare: send only the component tree, instead of the whole Dash
+            callback response
+
+    Returns:
+        response: the flask response
+    '''
+    payload.hits += 1
+    if bare:
+        name, plain, gzipped, brotlied = 'body', payload.body, payload.body_gzip, payload.body_brotli
+    else:
+        name, plain, gzipped, brotlied = 'response', payload.response, payload.gzip, payload.brotli
+    accepted = flask.request.headers.get('Accept-Encoding', '')
+    if brotlied is not None and 'br' in accepted:
+        data, encoding, name = brotlied, 'br', name + '.br'
+    elif 'gzip' in accepted:
+        data, encoding, name = gzipped, 'gzip', name + '.gz'
+    else:
+        data, encoding = plain, None
+    file = payload.bundle.open(payload.prefix + name) if payload.bundle is not None else None
+    if file is not None:
+        # Sent from the bundle file, WSGI servers do not send memoryviews
+        response = flask.Response(wrap_file(flask.request.environ, file), mimetype='application/json',
+                                  direct_passthrough=True)
+        response.content_length = len(data)
+    else:
+        response = flask.Response(bytes(data), mimetype='application/json')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['ETag'] = '"' + payload.etag + '"'
+    return response
+
+def _answer_tab_picker():
+    '''
+    Flask before_request hook. Answers the tab_picker callback requests
+    from the payload cache, anything else goes to Dash as usual.
+
+    Returns:
+        response: the cached response, None to let Dash handle it
+    '''
+    request = flask.request
+    if request.method != 'POST' or not request.path.endswith('_dash-update-component'):
+        return None
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or body.get('output') != OUTPUT or not isinstance(body.get('inputs'), list) or not body['inputs']:
+        return None
+    # Anything but a tab value is left to Dash to reject
+    value = body['inputs'][0].get('value') if isinstance(body['inputs'][0], dict) else None
+    if not isinstance(value, str):
+        return None
+    payload = get_payload(value)
+    if payload is None:
+        return None
+    return send_payload(payload)
+
+def _send_tab(value):
+    '''
+    Flask route sending the bare component tree of a tab, used by the
+    client side tab switching
+
+    Args:
+        value: the value of the tab
+
+    Returns:
+        response: the cached tab
+    '''
+    payload = get_payload(value)
+    if payload is None:
+        flask.abort(404)
+    if flask.request.if_none_match.contains(payload.etag):
+        return flask.Response(status=304)
+    return send_payload(payload, bare=True)
+
+def install(server):
+    '''
+    Start answering tab_picker from the cache, and serve the tabs at
+    /_tabs/<value>
+
+    Args:
+        server: the flask server of the app
+    '''
+    server.before_request(_answer_tab_picker)
+    server.add_url_rule('/_tabs/<value>', 'tabs', _send_tab)
+
+def get_stats():
+    '''
+    Get the payload cache statistics of this process
+
+    Returns:
+        stats: dictionary of tab value to serialization time, payload
+            bytes and hits
+    '''
+    stats = {}
+    for value, payload in list(_payloads.items()):
+        stats[value] = {
+            'generation': payload.generation,
+            'serialize_time': payload.serialize_time,
+            'compress_time': payload.compress_time,
+            'bytes': len(payload.response),
+            'gzip_bytes': len(payload.gzip),
+            'brotli_bytes': len(payload.brotli) if payload.brotli is not None else None,
+            'hits': payload.hits
+        }
+    return stats
@@ -0,0 +1,171 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import OrderedDict
+
+class Tab:
+    '''
+    A registered tab. Its layout is built on first use and kept until
+    it expires, or until its version changes.
+    '''
+    def __init__(self, value, builder, expiry=None, version=None):
+        self.value = value
+        self.builder = builder
+        self.expiry = expiry
+        self.version = version
+        self.lock = threading.Lock()
+        self.entry = (None, 0)
+        self.built_at = None
+        self.built_version = None
+        self.build_time = None
+        self.builds = 0
+
+    def is_stale(self):
+        '''
+        Check if the layout must be (re)built
+
+        Returns:
+            stale: True if never built, expired, or outdated
+        '''
+        if self.built_at is None:
+            return True
+        if self.expiry is not None and time.monotonic() - self.built_at > self.expiry:
+            return True
+        if self.version is not None and self.version() != self.built_version:
+            return True
+        return False
+
+    def build(self):
+        '''
+        Build the layout, timing it
+        '''
+        version = self.version() if self.version is not None else None
+        start = time.perf_counter()
+        layout = self.builder()
+        self.build_time = time.perf_counter() - start
+        self.builds += 1
+        # Layout and generation are swapped together, never torn
+        self.entry = (layout, self.builds)
+        self.built_version = version
+        self.built_at = time.monotonic()
+
+    def get(self):
+        '''
+        Get the layout, building it if needed. Only one thread builds,
+        others wait for it.
+
+        Returns:
+            layout: the layout of this tab
+            generation: the number of times the layout was built
+        '''
+        if self.is_stale():
+            with self.lock:
+                if self.is_stale():
+                    self.build()
+        return self.entry
+
+    def rebuild(self):
+        '''
+        Build the layout again now, the current one keeps being served
+        until the new one replaces it
+        '''
+        with self.lock:
+            self.build()
+
+_tabs = OrderedDict()
+
+def register_tab(value, builder, expiry=None, version=None):
+    '''
+    Register a tab to be built on first request
+
+    Args:
+        value: the value of the tab in the tabs component
+        builder: function creating the tab layout
+        expiry: seconds after which the layout is rebuilt, None to
+            keep it forever
+        version: function returning the version of the tab content,
+            the layout is rebuilt whenever it changes
+    '''
+    _tabs[value] = Tab(value, builder, expiry, version)
+
+def get_tab(value):
+    '''
+    Get the layout of a tab, built and memoized on first use
+
+    Args:
+        value: the value of the tab
+
+    Returns:
+        layout: the tab layout, None for an unknown tab
+    '''
+    tab = _tabs.get(value)
+    if tab is None:
+        return None
+    return tab.get()[0]
+
+def get_tab_generation(value):
+    '''
+    Get the layout of a tab together with its build count, which changes
+    whenever the layout is rebuilt
+
+    Args:
+        value: the value of the tab
+
+    Returns:
+        layout: the tab layout, None for an unknown tab
+        generation: the number of times the layout was built
+    '''
+    tab = _tabs.get(value)
+    if tab is None:
+        return None, 0
+    return tab.get()
+
+def iter_tabs():
+    '''
+    Get all registered tabs
+
+    Returns:
+        tabs: list of Tab, in registration order
+    '''
+    return list(_tabs.values())
+
+def warm_up():
+    '''
+    Build all tabs now. Used before gunicorn forks its workers (with
+    preload_app), so the workers start with every tab already built.
+    '''
+    for tab in _tabs.values():
+        tab.get()
+        print('Built tab ' + tab.value + ' (' + tab.builder.__name__ + ') in ' +
+              '{:.3f}'.format(tab.build_time) + ' seconds')
+
+def get_stats():
+    '''
+    Get the build statistics of all tabs in this process
+
+    Returns:
+        stats: dictionary of tab value to builder, build count and last
+            build time
+    '''
+    stats = {}
+    for tab in _tabs.values():
+        stats[tab.value] = {
+            'builder': tab.builder.__name__,
+            'builds': tab.builds,
+            'build_time': tab.build_time
+        }
+    return stats
@@ -17,6 +17,8 @@ import dash
 from dash import dcc as dcore
 from dash import html as dhtml
 
+from ContentBundle import read_markdown
+
 def create_teaching_layout():
     '''
     Create the layout of the teaching tab. This is just a simple
@@ -28,8 +30,7 @@ def create_teaching_layout():
         layout: The HTML body of the teaching tab
     '''
     # TODO: Add course pages when I teach entire courses again
-    with open('assets/content/teaching.md', 'r') as file:
-        teach_md = file.read()
+    teach_md = read_markdown('teaching')
     teach = dcore.Markdown(teach_md)
     layout = dhtml.Div(children=[teach], className='whole-row', style={'overflowY': 'scroll'})
     return layout
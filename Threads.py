@@ -0,0 +1,65 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import threading
+
+# Background threads are started once per process, on first use. Threads
+# do not survive a fork, so the names started are forgotten in a freshly
+# forked child (gunicorn workers forked from a preloaded app), which then
+# starts its own, the same way Database drops its connection pool.
+_lock = threading.Lock()
+_started = set()
+
+def _after_fork():
+    global _lock
+    _lock = threading.Lock()
+    _started.clear()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def start_thread(name, target, *args):
+    '''
+    Start a daemon thread, unless this process already started one with
+    the same name
+
+    Args:
+        name: the name of the thread
+        target: the function the thread runs
+        args: the arguments of the function
+
+    Returns:
+        started: True if this call started the thread
+    '''
+    if name in _started:
+        return False
+    with _lock:
+        if name in _started:
+            return False
+        threading.Thread(target=target, args=args, name=name, daemon=True).start()
+        _started.add(name)
+    return True
+
+def is_started(name):
+    '''
+    Check whether this process started a thread
+
+    Args:
+        name: the name of the thread
+
+    Returns:
+        started: True if the thread was started in this process
+    '''
+    return name in _started
@@ -0,0 +1,363 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import atexit
+import os
+import queue
+import threading
+import ipaddress
+import time
+from datetime import datetime
+
+from Database import connection
+import Rollup
+import Sketches
+from Geolocation import geolocate
+from Threads import start_thread
+
+# Visits are enriched (geolocated) and stored by background workers,
+# the request only drops the IP and time in this queue. The queue is
+# bounded so a slow geolocation service or database can never grow
+# memory or block a request, once it is full new visits are dropped.
+QUEUE_SIZE = int(os.environ.get('TRACKING_QUEUE_SIZE', '1000'))
+WORKERS = int(os.environ.get('TRACKING_WORKERS', '2'))
+# Hits on the same 5 minute key are counted in memory and written in
+# batches, every FLUSH_INTERVAL ms or once FLUSH_ROWS keys are waiting
+FLUSH_INTERVAL = int(os.environ.get('TRACKING_FLUSH_INTERVAL', '2000'))
+FLUSH_ROWS = int(os.environ.get('TRACKING_FLUSH_ROWS', '100'))
+# While the database fails, at most PENDING_LIMIT keys are kept waiting,
+# hits on new keys are dropped, and flushes are retried after a delay
+# doubling up to FLUSH_BACKOFF_MAX seconds
+PENDING_LIMIT = int(os.environ.get('TRACKING_PENDING_LIMIT', str(FLUSH_ROWS * 10)))
+FLUSH_BACKOFF_MAX = float(os.environ.get('TRACKING_FLUSH_BACKOFF_MAX', '60'))
+
+_lock = threading.Lock()
+_queue = None
+_pending = {}
+# Country name to id, countries are never removed
+_countries = {}
+_flush_now = threading.Event()
+_stats = {
+    'enqueued': 0,
+    'dropped': 0,
+    'processed': 0,
+    'failed': 0,
+    'coalesced': 0,
+    'flushes': 0,
+    'flush_failed': 0,
+    'pending_dropped': 0,
+    'rows_written': 0,
+    'latency_total': 0.0,
+    'latency_max': 0.0,
+    'flush_latency_max': 0.0
+}
+
+def tracking_enabled():
+    '''
+    Check whether the database is configured, tracking is skipped if not
+
+    Returns:
+        enabled: True if all database environment variables are set
+    '''
+    return bool(os.environ.get('DATABASE_USERNAME') and os.environ.get('DATABASE_PASSWORD') and
+                os.environ.get('DATABASE_HOSTNAME') and os.environ.get('DATABASE_SCHEMA'))
+
+def normalize_ip(ip):
+    '''
+    Clean the visitor IP, X-Forwarded-For may hold a list of proxies,
+    the first one is the visitor
+
+    Args:
+        ip: the IP, or list of IPs, of the visitor
+
+    Returns:
+        ip: the IP of the visitor
+    '''
+    return ip.split(',')[0].strip()
+
+def pack_ip(ip):
+    '''
+    Convert an IP to its binary form, 4 bytes for IPv4 and 16 for IPv6
+
+    Args:
+        ip: the IP to convert
+
+    Returns:
+        packed: the binary IP, empty if not a valid IP
+    '''
+    try:
+        return ipaddress.ip_address(ip).packed
+    except ValueError:
+        return b''
+
+def make_key(ip, now):
+    '''
+    Create the visits table key, the IP plus the time rounded to 5 mins
+
+    Args:
+        ip: the IP of the visitor
+        now: the time of the visit
+
+    Returns:
+        key: tuple of the binary IP and the time bucket
+    '''
+    mins = now.minute - (now.minute % 5)        # Round to 5 mins
+    return pack_ip(ip), datetime(now.year, now.month, now.day, now.hour, mins)
+
+def get_country_ids(db, names):
+    '''
+    Get the ids of countries, adding the new ones to the countries table.
+    Only names that are really missing are inserted, as every insert
+    attempt uses up an auto increment value. Ids read from the database
+    are not cached here, the caller remembers them once its transaction
+    is committed, as new rows are gone if it is rolled back.
+
+    Args:
+        db: the database cursor
+        names: the country names
+
+    Returns:
+        ids: dictionary of country name to id
+    '''
+    ids = {name: _countries[name] for name in set(names) if name in _countries}
+    missing = [name for name in set(names) if name not in ids]
+    if missing:
+        db.execute('SELECT name, id FROM countries WHERE name IN (' + ', '.join(['%s'] * len(missing)) + ')', missing)
+        ids.update(db.fetchall())
+        missing = [name for name in missing if name not in ids]
+    if missing:
+        # IGNORE, another worker may add the same country meanwhile
+        db.executemany('INSERT IGNORE INTO countries(name) VALUES(%s)', [(name,) for name in missing])
+        db.execute('SELECT name, id FROM countries WHERE name IN (' + ', '.join(['%s'] * len(missing)) + ')', missing)
+        ids.update(db.fetchall())
+    return {name: ids[name] for name in names}
+
+def clean_location(data):
+    '''
+    Replace the missing fields of a geolocation result with defaults
+
+    Args:
+        data: the geolocation dictionary
+
+    Returns:
+        location: tuple of country, state, city, postal, longitude, latitude
+    '''
+    longitude = data.get('longitude')
+    latitude = data.get('latitude')
+    if not longitude or longitude == 'Not found':
+        longitude = 0.0
+    if not latitude or latitude == 'Not found':
+        latitude = 0.0
+    return (data.get('country_name') or 'Not found', data.get('state') or 'Not found',
+            data.get('city') or 'Not found', data.get('postal') or 'Not found', longitude, latitude)
+
+def register_visits(rows):
+    '''
+    Store a batch of visits with a single upsert statement. Every row
+    carries the number of hits it stands for, so a row that already
+    exists is just incremented by that amount. The visitors are also
+    added to the unique visitor sketches, in the same transaction.
+
+    Args:
+        rows: list of (ip, bucket, country, state, city, postal,
+            longitude, latitude, visits) tuples
+    '''
+    with connection() as con:
+        db = con.cursor()
+        ids = get_country_ids(db, [row[2] for row in rows])
+        rows = [row[:2] + (ids[row[2]],) + row[3:] for row in rows]
+        db.executemany('INSERT INTO visits(ip, bucket, country_id, state, city, postal, longitude, latitude, visits) '
+                       'VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s) '
+                       'ON DUPLICATE KEY UPDATE visits = visits + VALUES(visits)', rows)
+        Sketches.add_visits(db, [(row[0], row[1].date(), row[2]) for row in rows])
+        con.commit()
+    _countries.update(ids)
+
+def _flush():
+    '''
+    Write all pending visits to the database. If that fails, they are
+    merged back and retried with the next flush, as long as there is room
+    for them.
+
+    Returns:
+        flushed: False if writing failed
+    '''
+    global _pending
+    with _lock:
+        pending = _pending
+        _pending = {}
+    if not pending:
+        return True
+    start = time.monotonic()
+    rows = [key + location + (visits,) for key, (location, visits) in pending.items()]
+    try:
+        register_visits(rows)
+    except Exception as e:
+        print(e)
+        with _lock:
+            _stats['flush_failed'] += 1
+            for key, (location, visits) in pending.items():
+                if key in _pending:
+                    visits += _pending[key][1]
+                elif len(_pending) >= PENDING_LIMIT:
+                    _stats['pending_dropped'] += visits
+                    continue
+                _pending[key] = (location, visits)
+        return False
+    latency = time.monotonic() - start
+    with _lock:
+        _stats['flushes'] += 1
+        _stats['rows_written'] += len(rows)
+        _stats['flush_latency_max'] = max(_stats['flush_latency_max'], latency)
+    return True
+
+def _flusher():
+    '''
+    Background loop, flushes pending visits every FLUSH_INTERVAL ms, or
+    earlier once FLUSH_ROWS distinct keys are waiting. After a failed
+    flush it waits longer and longer, instead of retrying right away.
+    '''
+    backoff = 0.0
+    while True:
+        _flush_now.wait(FLUSH_INTERVAL / 1000)
+        _flush_now.clear()
+        if _flush():
+            backoff = 0.0
+        else:
+            backoff = min(max(backoff * 2, FLUSH_INTERVAL / 1000), FLUSH_BACKOFF_MAX)
+            time.sleep(backoff)
+
+def _worker(visits):
+    '''
+    Background loop, enriches queued visits and adds them to the pending
+    batch. Hits on a key that is already pending are only counted, they
+    are not geolocated again.
+
+    Args:
+        visits: the queue to consume
+    '''
+    while True:
+        ip, now = visits.get()
+        start = time.monotonic()
+        ip = normalize_ip(ip)
+        key = make_key(ip, now)
+        failed = False
+        with _lock:
+            coalesced = key in _pending
+            if coalesced:
+                location, count = _pending[key]
+                _pending[key] = (location, count + 1)
+                _stats['coalesced'] += 1
+            full = not coalesced and len(_pending) >= PENDING_LIMIT
+            if full:
+                _stats['pending_dropped'] += 1
+        if not coalesced and not full:
+            try:
+                location = clean_location(geolocate(ip))
+                with _lock:
+                    count = _pending[key][1] if key in _pending else 0
+                    _pending[key] = (location, count + 1)
+                    if len(_pending) >= FLUSH_ROWS:
+                        _flush_now.set()
+            except Exception as e:
+                print(e)
+                failed = True
+        latency = time.monotonic() - start
+        with _lock:
+            if failed:
+                _stats['failed'] += 1
+            elif not full:
+                _stats['processed'] += 1
+            _stats['latency_total'] += latency
+            _stats['latency_max'] = max(_stats['latency_max'], latency)
+        visits.task_done()
+
+def _after_fork():
+    '''
+    Forget the parent's queue and pending visits in a freshly forked
+    child, its workers did not survive the fork
+    '''
+    global _lock
+    global _queue
+    global _pending
+    global _flush_now
+    _lock = threading.Lock()
+    _queue = None
+    _pending = {}
+    _flush_now = threading.Event()
+
+os.register_at_fork(after_in_child=_after_fork)
+# Do not lose the last batch on a clean shutdown
+atexit.register(_flush)
+
+def _get_queue():
+    '''
+    Get the visits queue, starting the workers on first use
+
+    Returns:
+        visits: the queue of this process
+    '''
+    global _queue
+    if _queue is not None:
+        return _queue
+    with _lock:
+        if _queue is None:
+            visits = queue.Queue(maxsize=QUEUE_SIZE)
+            for i in range(WORKERS):
+                start_thread('tracking-' + str(i), _worker, visits)
+            start_thread('tracking-flush', _flusher)
+            Rollup.start()
+            _queue = visits
+    return _queue
+
+def track_visit(ip):
+    '''
+    Queue a visit to be enriched and stored in the background. This never
+    blocks, if the queue is full the visit is dropped.
+
+    Args:
+        ip: the IP of the visitor
+
+    Returns:
+        queued: True if the visit was queued, False if dropped
+    '''
+    visits = _get_queue()
+    try:
+        visits.put_nowait((ip, datetime.now()))
+    except queue.Full:
+        with _lock:
+            _stats['dropped'] += 1
+        return False
+    with _lock:
+        _stats['enqueued'] += 1
+    return True
+
+def get_stats():
+    '''
+    Get the tracking statistics of this process, used to see backpressure
+
+    Returns:
+        stats: dictionary of queue depth, drop count, enrichment latency
+            and batched writes
+    '''
+    with _lock:
+        stats = dict(_stats)
+    done = stats['processed'] + stats['failed']
+    stats['queue_depth'] = _queue.qsize() if _queue is not None else 0
+    stats['queue_size'] = QUEUE_SIZE
+    stats['pending_rows'] = len(_pending)
+    stats['latency_avg'] = stats['latency_total'] / done if done else 0.0
+    del stats['latency_total']
+    return stats
@@ -17,6 +17,8 @@ import dash
 from dash import dcc as dcore
 from dash import html as dhtml
 
+from ContentBundle import read_markdown
+
 def create_work_layout():
     '''
     Create the layout of the teaching tab. This is just a simple
@@ -28,8 +30,7 @@ def create_work_layout():
         layout: The HTML body of the teaching tab
     '''
     # TODO: Utilize the "Detailed Results" tags in the research markdown
-    with open('assets/content/work.md', 'r') as file:
-        research_md = file.read()
+    research_md = read_markdown('work')
     research = dcore.Markdown(research_md)
     layout = dhtml.Div(children=[research], className='whole-column whole-row markdown', style={'overflowY': 'scroll'})
     return layout
@@ -0,0 +1,53 @@
+/*
+  Draws the bar showing the level of the hovered skill, from the skill
+  index built by Skills.py. Hovering a category keeps the last skill.
+*/
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    skills: {
+        draw_skill_level: function(hoverData, index) {
+            var skill;
+            if (!index) {
+                return window.dash_clientside.no_update;
+            }
+            if (!hoverData) {
+                // Pick the first ever skill
+                skill = index[Object.keys(index)[0]];
+            } else {
+                // Ids are the same as in the skill tree
+                skill = index[hoverData.points[0].id];
+            }
+            if (!skill) {
+                // A category, keep the last skill
+                return window.dash_clientside.no_update;
+            }
+            return {
+                data: [{
+                    type: 'bar',
+                    x: [0],
+                    y: [skill.value],
+                    marker: {color: [skill.color]},
+                    hoverinfo: 'text',
+                    hovertext: [skill.value + '%']
+                }],
+                layout: {
+                    title: {
+                        text: '<b>' + skill.label + '</b>',
+                        y: 0.95,
+                        x: 0.5,
+                        xanchor: 'center',
+                        yanchor: 'top',
+                        font: {family: 'Heebo', size: 24, color: 'black'}
+                    },
+                    xaxis: {visible: false},
+                    yaxis: {
+                        range: [0, 101],
+                        tickvals: [0, 20, 40, 60, 80, 100],
+                        ticktext: ['None', 'Just Started', 'Know Some', 'Good', 'Excellent', 'Master']
+                    },
+                    plot_bgcolor: 'rgba(0,0,0,0)',
+                    paper_bgcolor: 'rgba(0,0,0,0)'
+                }
+            };
+        }
+    }
+});
@@ -0,0 +1,52 @@
+/*
+  Client side tab switching, used when CLIENTSIDE_TABS is set.
+  Tab contents are fetched once from /_tabs/<value>, then every other
+  tab is prefetched in the background, so switching tabs never goes
+  back to the server.
+*/
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    tabs: {
+        cache: {},
+
+        fetch_tab: function(value) {
+            var cache = window.dash_clientside.tabs.cache;
+            if (!(value in cache)) {
+                cache[value] = fetch('/_tabs/' + encodeURIComponent(value))
+                    .then(function(response) {
+                        if (!response.ok) {
+                            throw new Error('Tab ' + value + ': ' + response.status);
+                        }
+                        return response.json();
+                    })
+                    .catch(function(error) {
+                        // Allow a retry on the next click
+                        delete cache[value];
+                        throw error;
+                    });
+            }
+            return cache[value];
+        },
+
+        prefetch: function(values) {
+            var tabs = window.dash_clientside.tabs;
+            var idle = window.requestIdleCallback || function(callback) { return setTimeout(callback, 200); };
+            idle(function() {
+                values.forEach(function(value) {
+                    tabs.fetch_tab(value).catch(function() {});
+                });
+            });
+        },
+
+        pick: function(value, children) {
+            var tabs = window.dash_clientside.tabs;
+            var first = Object.keys(tabs.cache).length === 0;
+            var content = tabs.fetch_tab(value);
+            if (first) {
+                // After the first paint, get everything else
+                var values = (children || []).map(function(tab) { return tab.props.value; });
+                content.then(function() { tabs.prefetch(values); }, function() {});
+            }
+            return content;
+        }
+    }
+});
@@ -0,0 +1,81 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Microbenchmark of the offline geolocation lookups. Run from the top
+# level directory as:
+#   python3 benchmarks/geolocation.py [compiled database directory]
+# Without a directory, a synthetic database is generated first.
+
+import os
+import sys
+import random
+import tempfile
+import time
+import ipaddress
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from GeoDatabase import GeoDatabase, compile_database
+
+RANGES = 200000
+LOOKUPS = 200000
+
+def make_synthetic(directory):
+    '''
+    Write and compile a database of random, non overlapping ranges
+
+    Args:
+        directory: where to put the CSV and the compiled arrays
+
+    Returns:
+        path: the compiled database directory
+    '''
+    csv_path = os.path.join(directory, 'ranges.csv')
+    v4 = sorted(random.sample(range(1 << 32), RANGES))
+    v6 = sorted(random.getrandbits(128) for i in range(RANGES))
+    with open(csv_path, 'w') as file:
+        for starts in (v4, v6):
+            for i in range(len(starts) - 1):
+                file.write('%d,%d,Country %d,State,City,0000,%f,%f\n' % (
+                    starts[i], starts[i + 1] - 1, i % 200, random.uniform(-90, 90), random.uniform(-180, 180)))
+    path = os.path.join(directory, 'compiled')
+    compile_database(csv_path, path)
+    return path
+
+def benchmark(database):
+    '''
+    Time random IPv4 and IPv6 lookups
+
+    Args:
+        database: the GeoDatabase to query
+    '''
+    for version, bits in ((4, 32), (6, 128)):
+        ips = [str(ipaddress.ip_address(random.getrandbits(bits))) if version == 6
+               else str(ipaddress.IPv4Address(random.getrandbits(bits))) for i in range(LOOKUPS)]
+        start = time.perf_counter()
+        for ip in ips:
+            database.lookup(ip)
+        elapsed = time.perf_counter() - start
+        print('IPv' + str(version) + ': ' + str(int(LOOKUPS / elapsed)) + ' lookups per second')
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        database = GeoDatabase(sys.argv[1])
+        print(str(len(database)) + ' ranges')
+        benchmark(database)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            database = GeoDatabase(make_synthetic(directory))
+            print(str(len(database)) + ' ranges')
+            benchmark(database)
@@ -0,0 +1,79 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Accuracy of the unique visitor sketches against exact counts, on
+# synthetic visitors. Run from the top level directory as:
+#   python3 benchmarks/sketches.py [visitors ...]
+
+import os
+import sys
+import random
+import ipaddress
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Sketches import HyperLogLog, REGISTERS
+
+DAYS = 7
+
+def make_visits(count):
+    '''
+    Create random visits over a week, most visitors come back more than
+    once and some on more than one day
+
+    Args:
+        count: the number of distinct visitors
+
+    Returns:
+        visits: list of (ip, day) tuples, the ip in binary form
+    '''
+    visitors = set()
+    while len(visitors) < count:
+        if random.random() < 0.8:
+            visitors.add(ipaddress.IPv4Address(random.getrandbits(32)).packed)
+        else:
+            visitors.add(ipaddress.IPv6Address(random.getrandbits(128)).packed)
+    visits = []
+    for ip in visitors:
+        for i in range(random.randint(1, 5)):
+            visits.append((ip, random.randrange(DAYS)))
+    random.shuffle(visits)
+    return visits
+
+def check(count):
+    '''
+    Compare the estimates of daily sketches, and of their merge over the
+    week, with the exact counts
+
+    Args:
+        count: the number of distinct visitors
+    '''
+    visits = make_visits(count)
+    sketches = [HyperLogLog() for day in range(DAYS)]
+    exact = [set() for day in range(DAYS)]
+    for ip, day in visits:
+        sketches[day].add(ip)
+        exact[day].add(ip)
+    errors = [abs(sketch.count() - len(ips)) / len(ips) for sketch, ips in zip(sketches, exact) if ips]
+    week = HyperLogLog()
+    for sketch in sketches:
+        week.merge(sketch)
+    week_error = abs(week.count() - count) / count
+    print(str(count) + ' visitors: daily error avg ' + '{:.2%}'.format(sum(errors) / len(errors)) +
+          ' max ' + '{:.2%}'.format(max(errors)) + ', weekly error ' + '{:.2%}'.format(week_error) +
+          ', ' + str(REGISTERS) + ' bytes per sketch')
+
+if __name__ == '__main__':
+    for count in (sys.argv[1:] or ['100', '1000', '10000', '100000']):
+        check(int(count))
@@ -0,0 +1,93 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmark of the /Visitors figures on synthetic data, shaped like the
+# daily visits and locations the page reads from the database. Run from
+# the top level directory as:
+#   python3 benchmarks/visitors.py [locations ...]
+
+import os
+import sys
+import random
+import time
+import pandas
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from subpages.Visitors import COLUMNS, draw_figure, bin_locations, draw_countries
+
+COUNTRIES = ['Canada', 'United States', 'Egypt', 'Germany', 'India', 'Not found']
+
+def make_daily(days):
+    '''
+    Create random daily visits, as returned by get_daily_visits
+
+    Args:
+        days: the number of days, ending today
+
+    Returns:
+        data: pandas dataframe with the Time and Visits columns
+    '''
+    today = datetime.today().date()
+    return pandas.DataFrame({'Time': pandas.to_datetime([today - timedelta(days=day) for day in range(days)]),
+                             'Visits': [random.randint(0, 500) for day in range(days)]})
+
+def make_locations(count):
+    '''
+    Create random locations, as returned by get_locations
+
+    Args:
+        count: the number of locations
+
+    Returns:
+        data: pandas dataframe with the Country, State, City, Postal,
+            Longitude, Latitude and Visits columns
+    '''
+    rows = []
+    for i in range(count):
+        located = random.random() < 0.9
+        rows.append((random.choice(COUNTRIES), 'State', 'City ' + str(i), 'Not found',
+                     random.uniform(-180, 180) if located else 0.0,
+                     random.uniform(-90, 90) if located else 0.0, random.randint(1, 500)))
+    return pandas.DataFrame(rows, columns=COLUMNS[1:])
+
+def benchmark(count):
+    '''
+    Time every figure of the page
+
+    Args:
+        count: the number of locations
+    '''
+    daily = make_daily(5 * 365)
+    data = make_locations(count)
+    timings = []
+    start = time.perf_counter()
+    draw_figure(daily)
+    timings.append(('daily visits', time.perf_counter() - start))
+    start = time.perf_counter()
+    bin_locations(data)
+    timings.append(('map pins', time.perf_counter() - start))
+    start = time.perf_counter()
+    bin_locations(data, 6, (-80, 43, -78, 44))
+    timings.append(('zoomed map pins', time.perf_counter() - start))
+    start = time.perf_counter()
+    draw_countries(data)
+    timings.append(('country map', time.perf_counter() - start))
+    print(str(count) + ' locations: ' + ', '.join(name + ' ' + '{:.3f}'.format(seconds) + 's'
+                                                  for name, seconds in timings))
+
+if __name__ == '__main__':
+    for count in (sys.argv[1:] or ['10000', '100000', '1000000']):
+        benchmark(int(count))
@@ -0,0 +1,15 @@
+import os
+
+# With PRELOAD_TABS set, the app is imported (and every tab built) once
+# in the master process, and the forked workers share the result
+preload_app = os.environ.get('PRELOAD_TABS', '') not in ('', '0')
+
+def post_worker_init(worker):
+    '''
+    Start the background jobs of every worker as soon as it has loaded
+    the app, instead of on its first request
+    '''
+    import CalendarCache
+    import ContentWatcher
+    CalendarCache.start()
+    ContentWatcher.start()
@@ -0,0 +1,58 @@
+/*
+  Tab switching and figure loading of the static export, see
+  StaticSite.py. Figures are only fetched once their tab is shown.
+  Figures with a live URL are fetched from the server first, and fall
+  back to the figure saved at build time.
+*/
+(function() {
+    function fetch_figure(url) {
+        return fetch(url).then(function(response) {
+            if (!response.ok) {
+                throw new Error(url + ': ' + response.status);
+            }
+            return response.json();
+        });
+    }
+
+    function load_figures(section) {
+        section.querySelectorAll('.static-graph:not([data-loaded])').forEach(function(graph) {
+            graph.setAttribute('data-loaded', '');
+            var figure;
+            if (graph.dataset.live) {
+                figure = fetch_figure(graph.dataset.live).catch(function() {
+                    return fetch_figure(graph.dataset.figure);
+                });
+            } else {
+                figure = fetch_figure(graph.dataset.figure);
+            }
+            figure.then(function(figure) {
+                Plotly.newPlot(graph, figure.data, figure.layout, {responsive: true});
+            });
+        });
+    }
+
+    function pick(value) {
+        document.querySelectorAll('[data-tab]').forEach(function(tab) {
+            var selected = tab.dataset.tab === value;
+            tab.className = selected ? tab.dataset.selectedClass : tab.dataset.class;
+        });
+        document.querySelectorAll('[data-section]').forEach(function(section) {
+            section.hidden = section.dataset.section !== value;
+            if (!section.hidden) {
+                load_figures(section);
+            }
+        });
+    }
+
+    document.addEventListener('DOMContentLoaded', function() {
+        document.querySelectorAll('[data-tab]').forEach(function(tab) {
+            tab.addEventListener('click', function() {
+                pick(tab.dataset.tab);
+            });
+        });
+        var first = document.querySelector('[data-tab]');
+        if (first) {
+            pick(first.dataset.tab);
+        }
+    });
+})();
@@ -20,85 +20,306 @@ from dash import dcc as dcore
 from dash import html as dhtml
 import plotly.graph_objs as go
 import pymysql
+import numpy
 import pandas
+import time
 from datetime import datetime, timedelta
 
-def get_visitors():
+from App import APP
+from Database import connection
+from Tracking import FLUSH_INTERVAL, FLUSH_BACKOFF_MAX
+import Sketches
+
+PAGE_SIZE = 50
+
+# How each table column is computed, and sorted, in SQL
+TIME_SQL = "DATE_FORMAT(v.bucket, '%%Y/%%m/%%d %%h:%%i%%p')"
+COUNTRY_SQL = "IF(c.name = 'Israel', 'Palestine', c.name)"
+TABLE_SQL = {
+    'Date and Time': TIME_SQL,
+    'Country': COUNTRY_SQL,
+    'State': 'v.state',
+    'City': 'v.city',
+    'Postal': 'v.postal',
+    'Visits': 'v.visits'
+}
+SORT_SQL = dict(TABLE_SQL, **{'Date and Time': 'v.bucket'})
+FROM_SQL = ' FROM visits v JOIN countries c ON c.id = v.country_id'
+# The map bins its pins on a grid, GRID_CELLS cells per map tile width,
+# never drawing more than MAX_MARKERS pins
+GRID_CELLS = int(os.environ.get('VISITORS_MAP_GRID_CELLS', '16'))
+MAX_MARKERS = int(os.environ.get('VISITORS_MAP_MAX_MARKERS', '2000'))
+LOCATIONS_TTL = 60
+# The live mode polls every LIVE_INTERVAL ms for visits newer than its
+# cursor, and only sends the changes to the page. Visits are written in
+# batches, as late as a flush interval plus the longest flush backoff
+# after their 5 minute bucket is over, so every poll fetches that window
+# before the cursor again.
+LIVE_INTERVAL = int(os.environ.get('VISITORS_LIVE_INTERVAL', '10000'))
+LIVE_WINDOW = timedelta(minutes=5, milliseconds=FLUSH_INTERVAL, seconds=FLUSH_BACKOFF_MAX)
+_locations = (0, None)
+FILTER_OPERATORS = {
+    '=': '=', 'eq': '=', '!=': '<>', 'ne': '<>', '<': '<', 'lt': '<', '<=': '<=', 'le': '<=',
+    '>': '>', 'gt': '>', '>=': '>=', 'ge': '>=', 'contains': 'LIKE', 'datestartswith': 'LIKE'
+}
+# DataTable prefixes operators with i or s for case insensitive or case
+# sensitive filtering, unprefixed ones follow the database collation
+FILTER_CASES = {
+    'i': 'LOWER({})',
+    's': 'CAST({} AS BINARY)'
+}
+# Matches nothing, for filters that are not understood
+NO_ROWS = ' WHERE 1 = 0'
+# LIKE patterns escape their wildcards with a backslash, as the query
+# parameters do their quotes
+LIKE_ESCAPE = " ESCAPE '\\\\'"
+
+def query(sql, params=()):
+    '''
+    Run a query on the database
+
+    Args:
+        sql: the query
+        params: the query parameters
+
+    Returns:
+        data: the list of rows, None on error
+    '''
+    with connection() as con:
+        db = con.cursor()
+        try:
+            db.execute(sql, params)
+            data = db.fetchall()
+            return data
+        except pymysql.Error as e:
+            if hasattr(e, 'message'):
+                print(e.message)
+            else:
+                print(e)
+            con.rollback()
+            return None
+
+def filter_to_sql(filter_query):
     '''
-    Get the list of visits and visitors from the database
+    Convert a DataTable filter query to a SQL condition. Only the simple
+    form the table generates is understood, {column} operator value
+    joined with &&. Anything else matches no rows, rather than showing
+    unfiltered rows under the filter.
+
+    Args:
+        filter_query: the filter query of the table
 
     Returns:
-        data: the list of data from database
+        where: the SQL condition, empty if nothing to filter
+        params: the condition parameters
+    '''
+    conditions = []
+    params = []
+    if ' || ' in (filter_query or ''):
+        return NO_ROWS, []
+    for part in (filter_query or '').split(' && '):
+        part = part.strip()
+        if not part:
+            continue
+        if not part.startswith('{') or '} ' not in part:
+            return NO_ROWS, []
+        column, rest = part[1:].split('} ', 1)
+        operator, _, value = rest.partition(' ')
+        case = None
+        if operator not in FILTER_OPERATORS and operator[:1] in FILTER_CASES and operator[1:] in FILTER_OPERATORS:
+            case, operator = operator[0], operator[1:]
+        if column not in TABLE_SQL or operator not in FILTER_OPERATORS:
+            return NO_ROWS, []
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'`':
+            value = value[1:-1]
+        sql, placeholder = TABLE_SQL[column], '%s'
+        if column == 'Visits':
+            try:
+                value = int(value)
+            except ValueError:
+                return NO_ROWS, []
+        else:
+            if FILTER_OPERATORS[operator] == 'LIKE':
+                value = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            if operator == 'contains':
+                value = '%' + value + '%'
+            elif operator == 'datestartswith':
+                value = value + '%'
+            if case is not None:
+                sql, placeholder = FILTER_CASES[case].format(sql), FILTER_CASES[case].format(placeholder)
+        if FILTER_OPERATORS[operator] == 'LIKE':
+            placeholder += LIKE_ESCAPE
+        conditions.append(sql + ' ' + FILTER_OPERATORS[operator] + ' ' + placeholder)
+        params.append(value)
+    if not conditions:
+        return '', []
+    return ' WHERE ' + ' AND '.join(conditions), params
+
+def get_page(page_current, page_size, sort_by, filter_query, count=True):
     '''
-    con = pymysql.connect(host=os.environ.get('DATABASE_HOSTNAME'), user=os.environ.get('DATABASE_USERNAME'), password=os.environ.get('DATABASE_PASSWORD'), db=os.environ.get('DATABASE_SCHEMA'))
-    db = con.cursor()
+    Get one page of visits, sorted and filtered by the database
+
+    Args:
+        page_current: the index of the page
+        page_size: the number of rows in a page
+        sort_by: list of dictionaries with column_id and direction
+        filter_query: the filter query of the table
+        count: also count the pages, which costs a scan of the visits
+
+    Returns:
+        rows: list of row dictionaries
+        page_count: the number of pages, None if not counted
+    '''
+    where, params = filter_to_sql(filter_query)
+    order = []
+    for sort in sort_by or []:
+        if sort.get('column_id') in SORT_SQL:
+            order.append(SORT_SQL[sort['column_id']] + (' DESC' if sort.get('direction') == 'desc' else ' ASC'))
+    order.append('v.bucket DESC')
+    columns = ', '.join(TABLE_SQL[column] for column in TABLE_SQL)
+    rows = query('SELECT ' + columns + FROM_SQL + where + ' ORDER BY ' + ', '.join(order) +
+                 ' LIMIT %s OFFSET %s', params + [page_size, page_current * page_size]) or []
+    rows = [dict(zip(TABLE_SQL, row)) for row in rows]
+    if not count:
+        return rows, None
+    count = query('SELECT COUNT(*)' + FROM_SQL + where, params)
+    total = count[0][0] if count else 0
+    return rows, max(1, -(-total // page_size))
+
+def get_new_visits(cursor):
+    '''
+    Get the visits of the buckets since a cursor. Visits of a bucket keep
+    being counted, and written, after it is over, so the buckets in the
+    LIVE_WINDOW before the cursor are fetched again, the caller
+    subtracts what it has already seen.
+
+    Args:
+        cursor: the last bucket seen, ISO formatted
+
+    Returns:
+        data: list of (key, day, country, state, city, postal, longitude,
+            latitude, visits) tuples, key is unique to a row
+    '''
+    return query("SELECT CONCAT(HEX(v.ip), '-', v.bucket), DATE_FORMAT(v.bucket, '%%Y/%%m/%%d'), " + COUNTRY_SQL +
+                 ', v.state, v.city, v.postal, v.longitude, v.latitude, v.visits' + FROM_SQL +
+                 ' WHERE v.bucket >= %s ORDER BY v.bucket', (_window_start(cursor),)) or []
+
+def _window_start(cursor):
+    return (datetime.fromisoformat(cursor) - LIVE_WINDOW).isoformat()
+
+def get_cursor(figure):
+    '''
+    Get the live mode cursor of a freshly built page, the latest bucket
+    and the visits already counted in it
+
+    Args:
+        figure: the visits figure of the page
+
+    Returns:
+        cursor: dictionary with the bucket, the seen visits by key, and
+            the last bar of the figure
+    '''
+    data = query('SELECT MAX(bucket) FROM visits', ())
+    bucket = data[0][0] if data and data[0][0] is not None else datetime.today()
+    cursor = bucket.isoformat()
+    bars = figure.data[0]
+    return {'bucket': cursor, 'seen': {row[0]: int(row[8]) for row in get_new_visits(cursor)},
+            'last': {'day': bars.x[-1], 'total': int(bars.y[-1]), 'index': len(bars.x) - 1}}
+
+def get_daily_visits():
+    '''
+    Sum the visits of every day, from the daily rollup, plus today's
+    visits that may not be rolled up yet
+
+    Returns:
+        data: pandas dataframe with the Time (day) and Visits columns
+    '''
+    data = query('SELECT day, SUM(visits) FROM visits_daily WHERE day < CURDATE() GROUP BY day '
+                 'UNION ALL SELECT CURDATE(), IFNULL(SUM(visits), 0) FROM visits WHERE bucket >= CURDATE()') or []
+    data = pandas.DataFrame(list(data), columns=['Time', 'Visits'])
+    data['Time'] = pandas.to_datetime(data['Time'])
+    data['Visits'] = pandas.to_numeric(data['Visits'])
+    return data
+
+def get_locations():
+    '''
+    Sum the visits of every distinct location, from the daily rollup,
+    plus today's visits that may not be rolled up yet
+
+    Returns:
+        data: pandas dataframe with the Country, State, City, Postal,
+            Longitude, Latitude and Visits columns
+    '''
+    data = query('SELECT ' + COUNTRY_SQL + " AS country, v.state, v.city, 'Not found', MAX(v.longitude), MAX(v.latitude), "
+                 'SUM(v.visits) FROM (SELECT country_id, state, city, longitude, latitude, visits FROM visits_daily '
+                 'WHERE day < CURDATE() UNION ALL SELECT country_id, state, city, longitude, latitude, visits FROM visits '
+                 'WHERE bucket >= CURDATE()) v JOIN countries c ON c.id = v.country_id '
+                 'GROUP BY country, v.state, v.city') or []
+    data = pandas.DataFrame(list(data), columns=COLUMNS[1:])
+    data['Longitude'] = pandas.to_numeric(data['Longitude'])
+    data['Latitude'] = pandas.to_numeric(data['Latitude'])
+    return data
+
+def get_unique_visitors(days=30):
+    '''
+    Estimate the unique visitors of every day, from the visitor sketches
+
+    Args:
+        days: the number of days, ending today
+
+    Returns:
+        data: pandas dataframe with the Time (day) and Visitors columns
+    '''
+    end = datetime.today().date()
     try:
-        db.execute('SELECT * FROM visitors')
-        data = db.fetchall()
-        return data
+        periods, counts = Sketches.unique_visitors_trend(end - timedelta(days=days - 1), end)
     except pymysql.Error as e:
-        if hasattr(e, 'message'):
-            print(e.message)
-        else:
-            print(e)
-        con.rollback()
-        return None
+        print(e)
+        periods, counts = [], []
+    return pandas.DataFrame({'Time': pandas.to_datetime(periods), 'Visitors': counts})
 
-def preprocess_visitors(data):
+COLUMNS = ['Date and Time', 'Country', 'State', 'City', 'Postal', 'Longitude', 'Latitude', 'Visits']
+
+def daily_visits(data):
     '''
-    Convert the database to a simpler pandas format
+    Sum the visits of every day, covering at least a month, with days
+    without visits filled in
 
     Args:
-        data: the list of data from database
+        data: the pandas dataframe of our data
 
     Returns:
-        new_data: the pandas dataframe of our data
+        dates: list of dates, formatted
+        visits: list of visits on each date
     '''
-    new_data = []
-    for datum in data:
-        date_time = datum[0].split('-')[1]
-        country = datum[1]
-        if datum[1] == 'Israel':
-            country = 'Palestine'
-        new_data.append((date_time, country, datum[2], datum[3], datum[4], datum[5], datum[6], datum[7]))
-    return new_data
+    today = pandas.Timestamp(datetime.today())
+    oldest = today - pandas.Timedelta(days=30)
+    if len(data) and data['Time'].min() < oldest:
+        oldest = data['Time'].min()
+    days = pandas.date_range(oldest.normalize(), today.normalize(), freq='D')
+    visits = data.groupby(data['Time'].dt.normalize())['Visits'].sum()
+    visits = visits.reindex(days, fill_value=0)
+    return list(days.strftime('%Y/%m/%d')), visits.tolist()
 
-def draw_figure(data):
+def draw_figure(data, visitors=None):
     '''
     Create the figure of visits over time
 
     Args:
         data: the pandas dataframe of our data
+        visitors: the pandas dataframe of unique visitors per day, None
+            to only show visits
 
     Returns:
         figure: The plotly figure, with the map drawn
     '''
-    # Create list from our data, cover at least a month
-    orig_visits = {}
-    oldest = datetime.today() - timedelta(days=30)
-    newest = datetime.today()
-    for i, row in data.iterrows():
-        date = row['Date and Time'].split(' ')[0]
-        if datetime.strptime(date, '%Y/%m/%d') < oldest:
-            oldest = datetime.strptime(date, '%Y/%m/%d')
-        if date in orig_visits:
-            orig_visits[date] += row['Visits']
-        else:
-            orig_visits[date] = row['Visits']
-    # Fill holes
-    dates = []
-    visits = []
-    delta = timedelta(days=1)
-    while oldest <= newest:
-        date = oldest.strftime('%Y/%m/%d')
-        dates.append(date)
-        if date not in orig_visits:
-            visits.append(0)
-        else:
-            visits.append(orig_visits[date])
-        oldest += delta
+    dates, visits = daily_visits(data)
 
-    fig = [go.Bar(x=dates, y=visits, showlegend=False)]
+    fig = [go.Bar(x=dates, y=visits, name='Visits', showlegend=False)]
+    if visitors is not None and len(visitors):
+        fig.append(go.Scatter(x=list(visitors['Time'].dt.strftime('%Y/%m/%d')), y=visitors['Visitors'].tolist(),
+                              mode='lines', name='Unique visitors', showlegend=False))
 
     layout = dict(
         margin=dict(pad=20),
@@ -110,56 +331,158 @@ def draw_figure(data):
     figure = go.Figure(data=fig, layout=layout)
     return figure
 
-def draw_map(data):
+def hover_text(data):
     '''
-    Create the map with the correct location pins
+    Create the hover text of every row, skipping unknown parts. The text
+    is only built once for every distinct location.
 
     Args:
         data: the pandas dataframe of our data
 
+    Returns:
+        text: numpy array of hover texts
+    '''
+    columns = ['Country', 'State', 'City', 'Postal']
+    groups = data.groupby(columns, sort=False)
+    codes = groups.ngroup().to_numpy()
+    locations = groups.size().index.to_frame(index=False)
+    text = pandas.Series('', index=locations.index)
+    for column, separator in (('Country', '<br>'), ('State', '<br>'), ('City', '<br>'), ('Postal', '')):
+        known = locations[column] != 'Not found'
+        text = text.where(~known, text + locations[column].astype(str) + separator)
+    return text.to_numpy()[codes]
+
+def grid_size(zoom):
+    '''
+    Get the size of the map bins at a zoom level, GRID_CELLS bins span
+    the width of one map tile, so they shrink as the map zooms in
+
+    Args:
+        zoom: the map zoom level
+
+    Returns:
+        size: the size of a bin in degrees
+    '''
+    return 360.0 / (2 ** max(zoom, 0) * GRID_CELLS)
+
+def bin_locations(data, zoom=0, bounds=None):
+    '''
+    Sum the visits of the locations falling in the same grid cell, so
+    the number of markers depends on the view rather than on the number
+    of locations. The grid is made coarser until at most MAX_MARKERS
+    cells are left.
+
+    Args:
+        data: the pandas dataframe of our locations
+        zoom: the map zoom level
+        bounds: the shown (west, south, east, north) bounds, None for
+            the whole world
+
+    Returns:
+        bins: pandas dataframe with the Longitude, Latitude (visits
+            weighted centre), Visits, Locations and Text of every cell
+    '''
+    # Skip unknown locations
+    located = data[(data['Latitude'] != 0.0) | (data['Longitude'] != 0.0)]
+    if bounds is not None:
+        west, south, east, north = bounds
+        inside = located['Latitude'].between(south, north)
+        if east - west < 360:
+            longitudes = (located['Longitude'] - west) % 360
+            inside &= longitudes <= (east - west)
+        located = located[inside]
+    located = located.assign(LonWeight=located['Longitude'] * located['Visits'],
+                             LatWeight=located['Latitude'] * located['Visits'])
+    size = grid_size(zoom)
+    while True:
+        cells = located.assign(X=(located['Longitude'] // size), Y=(located['Latitude'] // size))
+        groups = cells.groupby(['X', 'Y'], sort=False)
+        if groups.ngroups <= MAX_MARKERS:
+            break
+        size *= 2
+    bins = groups.agg(Visits=('Visits', 'sum'), Locations=('Visits', 'size'),
+                      LonWeight=('LonWeight', 'sum'), LatWeight=('LatWeight', 'sum'))
+    bins['Longitude'] = bins['LonWeight'] / bins['Visits']
+    bins['Latitude'] = bins['LatWeight'] / bins['Visits']
+    # Name every cell after its busiest location
+    busiest = cells.sort_values('Visits', ascending=False).drop_duplicates(['X', 'Y'])
+    busiest = busiest.assign(Text=hover_text(busiest)).set_index(['X', 'Y'])
+    bins['Text'] = busiest['Text'].reindex(bins.index)
+    return bins.reset_index()[['Longitude', 'Latitude', 'Visits', 'Locations', 'Text']]
+
+def map_view(relayout):
+    '''
+    Get the view of the map from its relayoutData
+
+    Args:
+        relayout: the relayoutData of the map, None before any change
+
+    Returns:
+        center: dictionary with lon and lat, None for the default
+        zoom: the zoom level
+        bounds: the shown (west, south, east, north) bounds, None for
+            the whole world
+    '''
+    if not relayout or 'mapbox.zoom' not in relayout:
+        return None, 0, None
+    center = relayout.get('mapbox.center')
+    zoom = relayout['mapbox.zoom']
+    bounds = None
+    corners = (relayout.get('mapbox._derived') or {}).get('coordinates')
+    if corners:
+        # Corners go clockwise from the top left, the view may cross the
+        # antimeridian, then east is less than west
+        west = corners[0][0]
+        east = corners[1][0]
+        if east < west:
+            east += 360
+        latitudes = [corner[1] for corner in corners]
+        bounds = (west, min(latitudes), east, max(latitudes))
+    return center, zoom, bounds
+
+def draw_map(data, relayout=None):
+    '''
+    Create the map with one pin per grid cell, sized by its visits
+
+    Args:
+        data: the pandas dataframe of our locations
+        relayout: the relayoutData of the map, to bin at its zoom and
+            only within its bounds
+
     Returns:
         figure: The plotly figure, with the map drawn
     '''
-    # Create lists
-    longitudes = []
-    latitudes = []
-    text = []
-    for i, row in data.iterrows():
-        if row['Latitude'] == 0.0 and row['Longitude'] == 0.0:
-            continue
-        latitudes.append(str(row['Latitude']))
-        longitudes.append(str(row['Longitude']))
-        new_text = ''
-        if row['Country'] != 'Not found':
-            new_text += row['Country'] + '<br>'
-        if row['State'] != 'Not found':
-            new_text += row['State'] + '<br>'
-        if row['City'] != 'Not found':
-            new_text += row['City'] + '<br>'
-        if row['Postal'] != 'Not found':
-            new_text += row['Postal']
-        text.append(new_text)
+    center, zoom, bounds = map_view(relayout)
+    bins = bin_locations(data, zoom, bounds)
+    text = (bins['Text'].str.replace(r'(<br>)+$', '', regex=True) + '<br>' + bins['Visits'].astype(str) + ' visits from ' +
+            bins['Locations'].astype(str) + ' locations').tolist()
+    sizes = (8 + 4 * numpy.log2(bins['Visits'].clip(lower=1))).round(1).tolist()
 
     # Create map
     fig = [go.Scattermapbox(
-        lat=latitudes,
-        lon=longitudes,
+        lat=bins['Latitude'].round(4).tolist(),
+        lon=bins['Longitude'].round(4).tolist(),
         mode='markers',
         marker=go.scattermapbox.Marker(
-            size=14
+            size=sizes
         ),
         hovertext=text,
         hoverinfo='text'
     )]
 
+    mapbox = dict(
+        style='open-street-map',
+        bearing=0,
+        pitch=0,
+        zoom=zoom
+    )
+    if center is not None:
+        mapbox['center'] = center
     layout = dict(
         hovermode='closest',
-        mapbox=dict(
-            style='open-street-map',
-            bearing=0,
-            pitch=0,
-            zoom=0
-        ),
+        mapbox=mapbox,
+        # Keep the view of the user when the pins are redrawn
+        uirevision='map',
         plot_bgcolor='rgba(0,0,0,0)',
         paper_bgcolor='rgba(0,0,0,0)',
         margin=dict(l=0, r=0, t=0, b=0)
@@ -169,27 +492,240 @@ def draw_map(data):
     figure = go.Figure(data=fig, layout=layout)
     return figure
 
-def create_table(data):
+def draw_countries(data):
     '''
-    Display a table with the data from our database
+    Create a map of visits per country
 
     Args:
-        data: the pandas dataframe of our data
+        data: the pandas dataframe of our locations
+
+    Returns:
+        figure: The plotly figure, with the map drawn
+    '''
+    countries = data[data['Country'] != 'Not found'].groupby('Country')['Visits'].sum()
+
+    fig = [go.Choropleth(
+        locations=countries.index.tolist(),
+        locationmode='country names',
+        z=countries.tolist(),
+        colorscale='Blues',
+        showscale=False,
+        hovertemplate='%{location}<br>%{z} visits<extra></extra>'
+    )]
+
+    layout = dict(
+        geo=dict(bgcolor='rgba(0,0,0,0)', showframe=False, projection=dict(type='natural earth')),
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        margin=dict(l=0, r=0, t=0, b=0)
+    )
+
+    # Return
+    figure = go.Figure(data=fig, layout=layout)
+    return figure
+
+def get_map_locations():
+    '''
+    Get the locations for the map, reused for LOCATIONS_TTL seconds so
+    panning and zooming do not query the database every time
+
+    Returns:
+        data: the pandas dataframe of our locations
+    '''
+    global _locations
+    fetched, data = _locations
+    if data is None or time.monotonic() - fetched > LOCATIONS_TTL:
+        data = get_locations()
+        _locations = (time.monotonic(), data)
+    return data
+
+@APP.callback(
+    dash.dependencies.Output('visitors-map', 'figure'),
+    [dash.dependencies.Input('visitors-map', 'relayoutData'),
+     dash.dependencies.Input('map-mode', 'value')],
+    prevent_initial_call=True)
+def update_map(relayout, mode):
+    '''
+    Bin the map again for its new view, or switch between pins and
+    countries
+
+    Args:
+        relayout: the relayoutData of the map
+        mode: either 'pins' or 'countries'
+
+    Returns:
+        figure: the new map figure
+    '''
+    if mode == 'countries':
+        # Countries do not depend on the view
+        if dash.callback_context.triggered and dash.callback_context.triggered[0]['prop_id'].startswith('visitors-map'):
+            return dash.no_update
+        return draw_countries(get_map_locations())
+    return draw_map(get_map_locations(), relayout)
+
+def create_table():
+    '''
+    Display a table with the data from our database. The table is
+    paged, sorted and filtered by the database, only one page is ever
+    sent.
 
     Returns:
         table: The plotly table, contaning all visitors data
     '''
     table = dash_table.DataTable(
         id='table',
-        columns=[{'name': i, 'id': i} for i in ['Date and Time', 'Country', 'State', 'City', 'Postal', 'Visits']],
-        data=data.to_dict('records'),
+        columns=[{'name': i, 'id': i} for i in TABLE_SQL],
+        data=[],
         style_table={'height': '98%', 'overflowY': 'auto'},
         style_header={'fontWeight': 'bold', 'backgroundColor': 'rgba(0,0,0,0.6)', 'padding': '20px', 'color': 'white'},
         style_cell={'textAlign': 'center', 'backgroundColor': 'rgba(0,0,0,0.3)', 'padding': '10px', 'whiteSpace': 'normal', 'height': 'auto'},
-        sort_action='native'
+        page_action='custom',
+        page_current=0,
+        page_size=PAGE_SIZE,
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[],
+        filter_action='custom',
+        filter_query=''
     )
     return table
 
+@APP.callback(
+    [dash.dependencies.Output('table', 'data'),
+     dash.dependencies.Output('table', 'page_count')],
+    [dash.dependencies.Input('table', 'page_current'),
+     dash.dependencies.Input('table', 'page_size'),
+     dash.dependencies.Input('table', 'sort_by'),
+     dash.dependencies.Input('table', 'filter_query')])
+def update_table(page_current, page_size, sort_by, filter_query):
+    '''
+    Fetch the shown page of the table
+
+    Args:
+        page_current: the index of the page
+        page_size: the number of rows in a page
+        sort_by: list of dictionaries with column_id and direction
+        filter_query: the filter query of the table
+
+    Returns:
+        data: the rows of the page
+        page_count: the number of pages
+    '''
+    return get_page(page_current or 0, page_size or PAGE_SIZE, sort_by, filter_query)
+
+@APP.callback(
+    dash.dependencies.Output('visitors-live', 'disabled'),
+    [dash.dependencies.Input('visitors-live-toggle', 'value')])
+def toggle_live(value):
+    '''
+    Start or stop polling for new visits
+
+    Args:
+        value: the checked options of the live toggle
+
+    Returns:
+        disabled: True to stop polling
+    '''
+    return 'live' not in (value or [])
+
+def apply_visits(cursor, rows):
+    '''
+    Find what changed since a cursor
+
+    Args:
+        cursor: the live mode cursor
+        rows: the visits since the cursor, from get_new_visits
+
+    Returns:
+        cursor: the moved cursor
+        days: dictionary of day to added visits
+        located: list of the rows of new locations
+    '''
+    seen = cursor['seen']
+    last = cursor['bucket']
+    days = {}
+    located = []
+    for row in rows:
+        key = row[0]
+        bucket = key.split('-', 1)[1].replace(' ', 'T')
+        added = int(row[8]) - seen.get(key, 0)
+        if added <= 0:
+            continue
+        days[row[1]] = days.get(row[1], 0) + added
+        if key not in seen and (float(row[6]) != 0.0 or float(row[7]) != 0.0):
+            located.append(row)
+        seen[key] = int(row[8])
+        last = max(last, bucket)
+    # Only the rows in the window before the newest bucket can still change
+    start = _window_start(last)
+    seen = {key: visits for key, visits in seen.items() if key.split('-', 1)[1].replace(' ', 'T') >= start}
+    return {'bucket': last, 'seen': seen}, days, located
+
+@APP.callback(
+    [dash.dependencies.Output('visitors-cursor', 'data'),
+     dash.dependencies.Output('visits-figure', 'figure'),
+     dash.dependencies.Output('visitors-map', 'figure', allow_duplicate=True),
+     dash.dependencies.Output('table', 'data', allow_duplicate=True)],
+    [dash.dependencies.Input('visitors-live', 'n_intervals')],
+    [dash.dependencies.State('visitors-cursor', 'data'),
+     dash.dependencies.State('map-mode', 'value'),
+     dash.dependencies.State('table', 'page_current'),
+     dash.dependencies.State('table', 'sort_by'),
+     dash.dependencies.State('table', 'filter_query')],
+    prevent_initial_call=True)
+def refresh_live(n_intervals, cursor, mode, page_current, sort_by, filter_query):
+    '''
+    Add the visits since the last poll to the page, as partial updates.
+    The cost only depends on the number of new visits.
+
+    Args:
+        n_intervals: the number of polls so far
+        cursor: the live mode cursor
+        mode: the map mode, either 'pins' or 'countries'
+        page_current: the shown page of the table
+        sort_by: the sort of the table
+        filter_query: the filter of the table
+
+    Returns:
+        cursor: the moved cursor
+        figure: the visits figure patch
+        map: the map figure patch
+        data: the table rows
+    '''
+    last = cursor['last']
+    cursor, days, located = apply_visits(cursor, get_new_visits(cursor['bucket']))
+    if not days:
+        return cursor, dash.no_update, dash.no_update, dash.no_update
+
+    # Visits figure, add to the bar of the last day, or add new days
+    chart = dash.Patch()
+    for day in sorted(days):
+        if day == last['day']:
+            last['total'] += days[day]
+            chart['data'][0]['y'][last['index']] = last['total']
+        elif day > last['day']:
+            last = {'day': day, 'total': days[day], 'index': last['index'] + 1}
+            chart['data'][0]['x'].append(day)
+            chart['data'][0]['y'].append(days[day])
+    cursor['last'] = last
+
+    # Map, add a pin for every new location until the next rebinning
+    pins = dash.no_update
+    if mode != 'countries' and located:
+        pins = dash.Patch()
+        data = pandas.DataFrame([row[2:] for row in located], columns=COLUMNS[1:])
+        pins['data'][0]['lat'].extend([round(float(row[7]), 4) for row in located])
+        pins['data'][0]['lon'].extend([round(float(row[6]), 4) for row in located])
+        text = pandas.Series(hover_text(data)).str.replace(r'(<br>)+$', '', regex=True)
+        pins['data'][0]['hovertext'].extend((text + '<br>New visit').tolist())
+        pins['data'][0]['marker']['size'].extend([8] * len(located))
+
+    # Table, only the first page in the default order shows new visits
+    rows = dash.no_update
+    if not page_current and not sort_by and not filter_query:
+        rows = get_page(0, PAGE_SIZE, sort_by, filter_query, count=False)[0]
+    return cursor, chart, pins, rows
+
 def create_layout():
     '''
     Initialize the general parent layout of the visitor tracker
@@ -200,19 +736,26 @@ def create_layout():
         layout: The HTML body of the whole page
     '''
 
-    data = list(get_visitors())
-    data = preprocess_visitors(data)
-    data = pandas.DataFrame(data, columns=['Date and Time', 'Country', 'State', 'City', 'Postal', 'Longitude', 'Latitude', 'Visits'])
-
     # Table
-    table = create_table(data)
+    table = create_table()
     table_div = dhtml.Div(children=[table], className='two-thirds-column', style={'float': 'left', 'align': 'left'})
 
     # Figure
-    figure_div = dcore.Graph(figure=draw_figure(data), className='one-third-row')
+    figure = draw_figure(get_daily_visits(), get_unique_visitors())
+    figure_div = dcore.Graph(id='visits-figure', figure=figure, className='one-third-row')
+
+    # Live mode
+    live = dcore.Checklist(id='visitors-live-toggle', options=[{'label': 'Live', 'value': 'live'}], value=[],
+                           labelStyle={'display': 'inline-block', 'padding': '0 10px'})
+    interval = dcore.Interval(id='visitors-live', interval=LIVE_INTERVAL, disabled=True)
+    cursor = dcore.Store(id='visitors-cursor', data=get_cursor(figure))
 
     # Map
-    map_div = dcore.Graph(figure=draw_map(data), className='two-thirds-row')
+    mode = dcore.RadioItems(id='map-mode', options=[{'label': 'Pins', 'value': 'pins'},
+                                                    {'label': 'Countries', 'value': 'countries'}],
+                            value='pins', labelStyle={'display': 'inline-block', 'padding': '0 10px'})
+    graph = dcore.Graph(id='visitors-map', figure=draw_map(get_map_locations()), style={'height': '95%'})
+    map_div = dhtml.Div(children=[mode, live, interval, cursor, graph], className='two-thirds-row')
 
     # Whole Thing
     view_div = dhtml.Div(children=[map_div, figure_div], className='one-third-column', style={'float': 'right', 'align': 'right'})
@@ -0,0 +1,55 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import json
+
+import CalendarCache
+
+FEED = b'''BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//test//test//EN
+END:VCALENDAR
+'''
+
+class FakeResponse(io.BytesIO):
+    headers = {'ETag': '"2"', 'Last-Modified': None}
+
+def test_refresh_without_raw_calendar(tmp_path, monkeypatch):
+    # The snapshot is from last week and the raw calendar is gone: the
+    # feed must be fetched whole, not with a conditional request
+    snapshot_file = str(tmp_path / 'calendar.json')
+    monkeypatch.setattr(CalendarCache, 'SNAPSHOT_FILE', snapshot_file)
+    with open(snapshot_file, 'w') as file:
+        json.dump({'window': '2000-01-03', 'fetched': 0, 'etag': '"1"', 'digest': 'old', 'events': []}, file)
+    requests = []
+    def urlopen(request, timeout):
+        requests.append(request)
+        return FakeResponse(FEED)
+    monkeypatch.setattr(CalendarCache.urllib.request, 'urlopen', urlopen)
+
+    assert CalendarCache.refresh()
+    assert requests[0].get_header('If-none-match') is None
+    with open(snapshot_file + '.ics', 'rb') as file:
+        assert file.read() == FEED
+    with open(snapshot_file) as file:
+        snapshot = json.load(file)
+    assert snapshot['etag'] == '"2"'
+    assert snapshot['window'] != '2000-01-03'
+
+    # With the raw calendar back, the next refresh is conditional
+    monkeypatch.setattr(CalendarCache, 'REFRESH_INTERVAL', -1)
+    assert CalendarCache.refresh()
+    assert requests[1].get_header('If-none-match') == '"2"'
@@ -0,0 +1,36 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import date
+
+import flask
+
+import Export
+
+def test_export_query_includes_archive():
+    sql, params = Export.export_query(date(2024, 1, 1), date(2024, 1, 31), 'Palestine')
+    assert sql.count('SELECT') == 2
+    assert 'FROM visits_archive v' in sql and 'FROM visits v' in sql
+    assert ' UNION ALL ' in sql and sql.endswith(' ORDER BY bucket')
+    assert params == [date(2024, 1, 1), date(2024, 2, 1), 'Palestine', 'Israel'] * 2
+
+def test_export_needs_access():
+    server = flask.Flask(__name__)
+    Export.install(server, lambda: flask.request.args.get('token') == 'secret')
+    client = server.test_client()
+    assert client.get('/_export/visitors.csv').status_code == 403
+    assert client.get('/_export/visitors.csv?token=wrong').status_code == 403
+    # Allowed, then rejected for its arguments before any query is run
+    assert client.get('/_export/visitors.csv?token=secret&start=yesterday').status_code == 400
@@ -0,0 +1,75 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ipaddress
+
+from GeoDatabase import compile_database, GeoDatabase
+
+V4_CSV = '''ip_from,ip_to,country,state,city,postal,latitude,longitude
+1.0.0.0,1.0.0.255,Australia,Queensland,Brisbane,4000,-27.46,153.02
+16777472,16778239,China,Fujian,Fuzhou,350000,26.06,119.30
+8.8.8.0,8.8.8.255,United States,California,Mountain View,94043,37.40,-122.07
+'''
+
+# Integer IPv6 CSV, the IPv4 ranges are IPv4 mapped addresses
+V6_CSV = '''"0","281470681743359","-","-","-","-","0","0"
+"281470698520576","281470698520831","Australia","Queensland","Brisbane","4000","-27.46","153.02"
+"281470698520832","281470698521599","China","Fujian","Fuzhou","350000","26.06","119.30"
+"42540766411282592856903984951653826560","42540766490510755371168322545197776895","Canada","Ontario","Toronto","M5S","43.66","-79.39"
+'''
+
+def compile_csv(tmp_path, text, ipv6=False):
+    path = tmp_path / 'ranges.csv'
+    path.write_text(text)
+    count = compile_database(str(path), str(tmp_path / 'geodb'), ipv6)
+    return count, GeoDatabase(str(tmp_path / 'geodb'))
+
+def test_ipv4(tmp_path):
+    count, database = compile_csv(tmp_path, V4_CSV)
+    assert count == 3
+    assert database.lookup('1.0.0.7')['city'] == 'Brisbane'
+    assert database.lookup('1.0.1.1')['city'] == 'Fuzhou'
+    assert database.lookup('8.8.8.8')['postal'] == '94043'
+    assert database.lookup('::ffff:8.8.8.8')['postal'] == '94043'
+    assert database.lookup('9.9.9.9')['country_name'] == 'Not found'
+    assert database.lookup('2001:db8::1')['country_name'] == 'Not found'
+    assert database.lookup('garbage')['country_name'] == 'Not found'
+
+def test_ipv6(tmp_path):
+    count, database = compile_csv(tmp_path, V6_CSV)
+    assert count == 4
+    assert len(database.v4_start) == 2
+    assert database.lookup('1.0.0.7')['city'] == 'Brisbane'
+    assert database.lookup('::ffff:1.0.1.1')['city'] == 'Fuzhou'
+    assert database.lookup('2001:db8::1')['city'] == 'Toronto'
+    assert database.lookup(str(ipaddress.ip_address(42540766490510755371168322545197776895)))['city'] == 'Toronto'
+    assert database.lookup('2001:dc0::1')['country_name'] == 'Not found'
+    assert database.lookup('::1')['country_name'] == '-'
+    assert database.lookup('9.9.9.9')['country_name'] == 'Not found'
+
+def test_mapped_range_split(tmp_path):
+    # One IPv6 range spanning the IPv4 mapped block is split around it
+    first = int(ipaddress.ip_address('::fffe:0:0'))
+    last = int(ipaddress.ip_address('::1:0:0:0'))
+    count, database = compile_csv(tmp_path, '%d,%d,Somewhere,-,-,-,0,0\n' % (first, last))
+    assert count == 3
+    for ip in ('::fffe:0:1', '4.4.4.4', '::1:0:0:0'):
+        assert database.lookup(ip)['country_name'] == 'Somewhere'
+
+def test_ipv6_flag(tmp_path):
+    # Small integers are IPv6 when the CSV says so
+    count, database = compile_csv(tmp_path, '1,255,Somewhere,-,-,-,0,0\n', ipv6=True)
+    assert len(database.v4_start) == 0
+    assert database.lookup('::1')['country_name'] == 'Somewhere'
@@ -0,0 +1,74 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ipaddress
+import math
+import random
+
+import pytest
+
+from Sketches import HyperLogLog, REGISTERS
+
+# Four standard errors of the estimate, the inputs are seeded
+BOUND = 4 * 1.04 / math.sqrt(REGISTERS)
+
+def make_ips(rng, count):
+    ips = set()
+    while len(ips) < count:
+        if rng.random() < 0.8:
+            ips.add(ipaddress.IPv4Address(rng.getrandbits(32)).packed)
+        else:
+            ips.add(ipaddress.IPv6Address(rng.getrandbits(128)).packed)
+    return list(ips)
+
+def relative_error(sketch, count):
+    return abs(sketch.count() - count) / count
+
+def test_empty():
+    assert HyperLogLog().count() == 0
+
+@pytest.mark.parametrize('count', [10, 1000, 5000, 50000])
+def test_count(count):
+    rng = random.Random(count)
+    sketch = HyperLogLog()
+    for ip in make_ips(rng, count):
+        # Repeated visits do not count
+        for i in range(rng.randint(1, 3)):
+            sketch.add(ip)
+    assert relative_error(sketch, count) <= BOUND
+
+def test_merge_days():
+    # A week of daily sketches, visitors coming back on several days
+    rng = random.Random(7)
+    ips = make_ips(rng, 20000)
+    days = [HyperLogLog() for day in range(7)]
+    exact = [set() for day in range(7)]
+    for ip in ips:
+        for day in rng.sample(range(7), rng.randint(1, 3)):
+            days[day].add(ip)
+            exact[day].add(ip)
+    for sketch, seen in zip(days, exact):
+        assert relative_error(sketch, len(seen)) <= BOUND
+
+    week = HyperLogLog()
+    for sketch in days:
+        # Stored and read back, as add_visits does
+        week.merge(HyperLogLog(sketch.to_bytes()))
+    assert relative_error(week, len(ips)) <= BOUND
+    # Merging is idempotent and does not depend on the order
+    again = HyperLogLog()
+    for sketch in reversed(days + days):
+        again.merge(sketch)
+    assert again.count() == week.count()
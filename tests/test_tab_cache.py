@@ -0,0 +1,84 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.request
+
+import pytest
+from werkzeug.serving import make_server
+
+# The bundled tabs must go through a real WSGI server, the flask test
+# client accepts response bodies a server would not send.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='module')
+def server():
+    directory = tempfile.mkdtemp()
+    os.environ['CONTENT_BUNDLE'] = os.path.join(directory, 'content.bundle')
+    os.environ['CONTENT_WATCH'] = '0'
+    subprocess.run([sys.executable, 'ContentBundle.py'], cwd=ROOT, check=True)
+    import Resume
+    import TabCache
+    wsgi = make_server('127.0.0.1', 0, Resume.server, threaded=True)
+    thread = threading.Thread(target=wsgi.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:' + str(wsgi.server_port), TabCache
+    wsgi.shutdown()
+
+def fetch(url, data=None, headers={}):
+    request = urllib.request.Request(url, data=data, headers=headers)
+    with urllib.request.urlopen(request) as response:
+        return response.headers, response.read()
+
+@pytest.mark.parametrize('value', ['2', '3', '4', '5'])
+def test_bundled_tab(server, value):
+    url, TabCache = server
+    payload = TabCache.get_payload(value)
+    assert payload.generation == 'bundle'
+    assert isinstance(payload.body, memoryview)
+    headers, body = fetch(url + '/_tabs/' + value)
+    assert body == payload.body
+    assert int(headers['Content-Length']) == len(body)
+    headers, body = fetch(url + '/_tabs/' + value, headers={'Accept-Encoding': 'gzip'})
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(body) == payload.body
+
+def test_tab_picker(server):
+    url, TabCache = server
+    request = {'output': TabCache.OUTPUT, 'outputs': {'id': 'body-div', 'property': 'children'},
+               'inputs': [{'id': 'tabs', 'property': 'value', 'value': '3'}], 'changedPropIds': ['tabs.value']}
+    headers, body = fetch(url + '/_dash-update-component', json.dumps(request).encode('utf-8'),
+                          {'Content-Type': 'application/json'})
+    assert body == TabCache.get_payload('3').response
+    assert json.loads(body)['response']['body-div']['children']
+
+@pytest.mark.parametrize('body', [
+    [1],
+    {'output': 'body-div.children', 'inputs': 'tabs'},
+    {'output': 'body-div.children', 'inputs': ['tabs']},
+    {'output': 'body-div.children', 'inputs': [{'id': 'tabs', 'property': 'value', 'value': ['3']}]},
+    {'output': 'body-div.children', 'inputs': [{'id': 'tabs', 'property': 'value', 'value': {'a': 1}}]},
+])
+def test_tab_picker_malformed(server, body):
+    url, TabCache = server
+    import Resume
+    with Resume.server.test_request_context('/_dash-update-component', method='POST', json=body):
+        assert TabCache._answer_tab_picker() is None
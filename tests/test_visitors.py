@@ -0,0 +1,75 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from subpages.Visitors import filter_to_sql, NO_ROWS
+
+@pytest.mark.parametrize('operator, sql', [
+    ('=', '='), ('eq', '='), ('!=', '<>'), ('ne', '<>'), ('<', '<'), ('lt', '<'),
+    ('<=', '<='), ('le', '<='), ('>', '>'), ('gt', '>'), ('>=', '>='), ('ge', '>=')
+])
+def test_comparison(operator, sql):
+    assert filter_to_sql('{City} ' + operator + ' "Haifa"') == (' WHERE v.city ' + sql + ' %s', ['Haifa'])
+    assert filter_to_sql('{Visits} ' + operator + ' 3') == (' WHERE v.visits ' + sql + ' %s', [3])
+
+def test_contains():
+    assert filter_to_sql('{City} contains Hai') == (" WHERE v.city LIKE %s ESCAPE '\\\\'", ['%Hai%'])
+
+def test_datestartswith():
+    assert filter_to_sql('{Date and Time} datestartswith 2024/01') == \
+        (" WHERE DATE_FORMAT(v.bucket, '%%Y/%%m/%%d %%h:%%i%%p') LIKE %s ESCAPE '\\\\'", ['2024/01%'])
+
+def test_like_wildcards_escaped():
+    where, params = filter_to_sql('{Postal} contains "10%_\\\\"')
+    assert params == ['%10\\%\\_\\\\\\\\%']
+    # Only LIKE values are escaped
+    assert filter_to_sql('{Postal} = "10%_"')[1] == ['10%_']
+
+def test_case():
+    assert filter_to_sql('{City} icontains hai') == (" WHERE LOWER(v.city) LIKE LOWER(%s) ESCAPE '\\\\'", ['%hai%'])
+    assert filter_to_sql('{State} s= "Ontario"') == (' WHERE CAST(v.state AS BINARY) = CAST(%s AS BINARY)', ['Ontario'])
+
+def test_and():
+    assert filter_to_sql('{City} = Haifa && {Visits} >= 2') == (' WHERE v.city = %s AND v.visits >= %s', ['Haifa', 2])
+
+@pytest.mark.parametrize('query', [
+    '{City} = Haifa || {City} = Acre', '{Password} = x', '{City} like x', '{Visits} > many', 'City = Haifa'
+])
+def test_not_understood(query):
+    assert filter_to_sql(query) == (NO_ROWS, [])
+
+@pytest.mark.parametrize('query', [None, '', '  '])
+def test_empty(query):
+    assert filter_to_sql(query) == ('', [])
+
+def row(ip, bucket, visits):
+    return (ip + '-' + bucket, bucket[:10].replace('-', '/'), 'Canada', 'Ontario', 'Toronto', 'M5S', '-79.39', '43.66',
+            visits)
+
+def test_apply_late_visits():
+    from subpages.Visitors import apply_visits
+    cursor = {'bucket': '2024-01-02T10:05:00', 'seen': {'AA-2024-01-02 10:05:00': 2, 'BB-2024-01-02 10:00:00': 1,
+                                                          'CC-2024-01-02 09:00:00': 1}}
+    # A visit of the previous bucket written after the cursor moved on,
+    # and one more visit of a row already seen
+    cursor, days, located = apply_visits(cursor, [row('BB', '2024-01-02 10:00:00', 1),
+                                                  row('DD', '2024-01-02 10:00:00', 1),
+                                                  row('AA', '2024-01-02 10:05:00', 3)])
+    assert days == {'2024/01/02': 2}
+    assert [r[0] for r in located] == ['DD-2024-01-02 10:00:00']
+    assert cursor['bucket'] == '2024-01-02T10:05:00'
+    # Rows that can no longer change are forgotten
+    assert set(cursor['seen']) == {'AA-2024-01-02 10:05:00', 'BB-2024-01-02 10:00:00', 'DD-2024-01-02 10:00:00'}
@@ -0,0 +1,149 @@
+# Copyright (C) 2020 Mohammad Ewais
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Copies the old visitors table (char(40) 'ip-YYYY/MM/DD HH:MMam' keys)
+# into the visits and countries tables of visitors.sql, in batches. Old
+# keys that end up on the same visits row (the same IP once the proxy
+# list is removed) are added together, so it must be run once. Every
+# batch is committed with the last id copied, if stopped it resumes
+# from there, given as the second argument. Keys that can not be parsed
+# are skipped and counted. The old table is left untouched. Run from the
+# top level directory, with the usual DATABASE_* environment variables:
+#   python3 tools/migrate_visitors.py [batch size] [last id]
+
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Database import connection
+from Tracking import normalize_ip, pack_ip, get_country_ids
+
+BATCH_SIZE = 5000
+
+# The same questions asked of both schemas, to compare them
+OLD_QUERIES = {
+    'daily visits': "SELECT DATE(STR_TO_DATE(RIGHT(id, 18), '%Y/%m/%d %h:%i%p')) AS day, SUM(visits) "
+                    "FROM visitors GROUP BY day",
+    'last 7 days': "SELECT COUNT(*) FROM visitors "
+                   "WHERE STR_TO_DATE(RIGHT(id, 18), '%Y/%m/%d %h:%i%p') >= NOW() - INTERVAL 7 DAY",
+    'one country, last 30 days': "SELECT COUNT(*) FROM visitors WHERE country = 'Canada' "
+                                 "AND STR_TO_DATE(RIGHT(id, 18), '%Y/%m/%d %h:%i%p') >= NOW() - INTERVAL 30 DAY"
+}
+NEW_QUERIES = {
+    'daily visits': 'SELECT DATE(bucket) AS day, SUM(visits) FROM visits GROUP BY day',
+    'last 7 days': 'SELECT COUNT(*) FROM visits WHERE bucket >= NOW() - INTERVAL 7 DAY',
+    'one country, last 30 days': "SELECT COUNT(*) FROM visits JOIN countries c ON c.id = visits.country_id "
+                                 "WHERE c.name = 'Canada' AND bucket >= NOW() - INTERVAL 30 DAY"
+}
+
+def convert(row):
+    '''
+    Convert an old visitors row to a visits row
+
+    Args:
+        row: tuple of id, country, state, city, postal, longitude,
+            latitude, visits
+
+    Returns:
+        row: tuple of ip, bucket, country, state, city, postal,
+            longitude, latitude, visits, None if the id can not be parsed
+    '''
+    try:
+        ip, when = row[0].rsplit('-', 1)
+        bucket = datetime.strptime(when, '%Y/%m/%d %I:%M%p')
+    except ValueError:
+        return None
+    return (pack_ip(normalize_ip(ip)), bucket) + tuple(row[1:])
+
+def migrate(batch_size, last=''):
+    '''
+    Copy all rows, batch by batch in id order
+
+    Args:
+        batch_size: the number of rows per batch
+        last: copy the rows after this id, empty for all of them
+
+    Returns:
+        count: the number of rows copied
+        skipped: the number of rows with an id that could not be parsed
+    '''
+    count = 0
+    skipped = 0
+    while True:
+        with connection() as con:
+            db = con.cursor()
+            db.execute('SELECT id, country, state, city, postal, longitude, latitude, visits FROM visitors '
+                       'WHERE id > %s ORDER BY id LIMIT %s', (last, batch_size))
+            rows = db.fetchall()
+            if not rows:
+                return count, skipped
+            last = rows[-1][0]
+            converted = [convert(row) for row in rows]
+            rows = [row for row in converted if row is not None]
+            skipped += len(converted) - len(rows)
+            if not rows:
+                continue
+            ids = get_country_ids(db, [row[2] for row in rows])
+            rows = [row[:2] + (ids[row[2]],) + row[3:] for row in rows]
+            db.executemany('INSERT INTO visits(ip, bucket, country_id, state, city, postal, longitude, latitude, visits) '
+                           'VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s) '
+                           'ON DUPLICATE KEY UPDATE visits = visits + VALUES(visits)', rows)
+            con.commit()
+        count += len(rows)
+        print('Copied ' + str(count) + ' rows, skipped ' + str(skipped) + ', last id ' + last)
+
+def report_sizes(tables):
+    '''
+    Print the row, data and index sizes of tables
+
+    Args:
+        tables: the names of the tables
+    '''
+    with connection() as con:
+        db = con.cursor()
+        db.execute('ANALYZE TABLE ' + ', '.join(tables))
+        db.fetchall()
+        db.execute('SELECT TABLE_NAME, TABLE_ROWS, AVG_ROW_LENGTH, DATA_LENGTH, INDEX_LENGTH '
+                   'FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN (' +
+                   ', '.join(['%s'] * len(tables)) + ')', tables)
+        for name, rows, row_length, data_length, index_length in db.fetchall():
+            print(name + ': ' + str(rows) + ' rows, ' + str(row_length) + ' bytes per row, ' +
+                  str(data_length) + ' bytes of data, ' + str(index_length) + ' bytes of indexes')
+
+def report_queries(queries, label):
+    '''
+    Print the time taken by queries
+
+    Args:
+        queries: dictionary of name to query
+        label: which schema the queries are for
+    '''
+    with connection() as con:
+        db = con.cursor()
+        for name, sql in queries.items():
+            start = time.perf_counter()
+            db.execute(sql)
+            db.fetchall()
+            print(label + ' ' + name + ': ' + '{:.4f}'.format(time.perf_counter() - start) + ' seconds')
+
+if __name__ == '__main__':
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else BATCH_SIZE
+    count, skipped = migrate(batch_size, sys.argv[2] if len(sys.argv) > 2 else '')
+    print('Copied ' + str(count) + ' rows in total, skipped ' + str(skipped) + ' unparseable ids')
+    report_sizes(['visitors', 'visits', 'countries'])
+    report_queries(OLD_QUERIES, 'old')
+    report_queries(NEW_QUERIES, 'new')
@@ -1,16 +1,52 @@
-create table visitors
+create table countries
 (
-    id        char(40)           not null,
-    country   char(200)          not null,
-    state     char(200)          not null,
-    city      char(200)          not null,
-    postal    char(20)           not null,
-    longitude decimal(11, 8)     not null,
-    latitude  decimal(10, 8)     not null,
-    visits    smallint default 1 not null,
-    constraint visitors_id_uindex
-        unique (id)
+    id   smallint unsigned auto_increment
+        primary key,
+    name varchar(200) not null,
+    constraint countries_name_uindex
+        unique (name)
 );
 
-alter table visitors
-    add primary key (id);
+create table visits
+(
+    ip         varbinary(16)          not null,
+    bucket     datetime               not null,
+    country_id smallint unsigned      not null,
+    state      varchar(200)           not null,
+    city       varchar(200)           not null,
+    postal     varchar(20)            not null,
+    longitude  decimal(11, 8)         not null,
+    latitude   decimal(10, 8)         not null,
+    visits     int unsigned default 1 not null,
+    primary key (ip, bucket),
+    constraint visits_countries_id_fk
+        foreign key (country_id) references countries (id)
+);
+
+create index visits_bucket_index
+    on visits (bucket);
+
+create index visits_country_id_bucket_index
+    on visits (country_id, bucket);
+
+create table visits_daily
+(
+    day        date                   not null,
+    country_id smallint unsigned      not null,
+    state      varchar(200)           not null,
+    city       varchar(200)           not null,
+    longitude  decimal(11, 8)         not null,
+    latitude   decimal(10, 8)         not null,
+    visits     int unsigned           not null,
+    primary key (day, country_id, state, city)
+);
+
+create table visits_archive like visits;
+
+create table visitor_sketches
+(
+    day        date              not null,
+    country_id smallint unsigned not null,
+    registers  blob              not null,
+    primary key (day, country_id)
+);